@@ -4,3 +4,14 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        from reportlab.pdfbase import pdfmetrics
+        from reportlab.pdfbase.ttfonts import TTFont
+
+        from api import signals  # noqa: F401
+        from foodgram_backend import constants
+
+        # Шрифт для списка покупок разбираем один раз при старте приложения
+        pdfmetrics.registerFont(
+            TTFont(constants.FONT_NAME, constants.FONT_PATH))
@@ -0,0 +1,231 @@
+import json
+from collections import Counter
+
+from django.contrib.auth import get_user_model
+from django.db import DatabaseError, connections, transaction
+
+from api.conditional import AUTHORS_VERSION, RECIPES_VERSION
+from api.serializers import RecipeImportSerializer
+from foodgram_backend import constants
+from recipes.counters import change_counter
+from recipes.models import (CatalogueVersion, Ingredient, Recipe,
+                            RecipeIngredient, Tag)
+
+User = get_user_model()
+
+
+class RecipeImporter:
+    """Импорт рецептов из JSON lines пакетами через bulk_create.
+
+    Строки проверяются сериализатором по одной, а ссылки на ингредиенты,
+    теги и авторов - одним запросом на пакет. Каждый пакет сохраняется
+    в своей транзакции, сигналы не отправляются, поэтому счетчики
+    рецептов и версии для ETag обновляются здесь же.
+    """
+
+    def __init__(self, author=None, use_row_author=False,
+                 batch_size=constants.RECIPE_IMPORT_BATCH_SIZE):
+        # Автор из строки учитывается только если это разрешено явно,
+        # иначе все рецепты записываются на author
+        self.author = author
+        self.use_row_author = use_row_author
+        self.batch_size = batch_size
+        self.created = 0
+        self.errors = []
+        self.seen_names = set()
+
+    def add_error(self, line_number, errors):
+        self.errors.append({'line': line_number, 'errors': errors})
+
+    def parse_line(self, line_number, line):
+        try:
+            if isinstance(line, bytes):
+                line = line.decode()
+            data = json.loads(line)
+        except ValueError:
+            # UnicodeDecodeError тоже ValueError: строка не в UTF-8
+            data = None
+        if not isinstance(data, dict):
+            self.add_error(
+                line_number,
+                {'non_field_errors': [constants.MESSAGE_ERROR_INVALID_JSON]},
+            )
+            return None
+        serializer = RecipeImportSerializer(data=data)
+        if not serializer.is_valid():
+            self.add_error(line_number, serializer.errors)
+            return None
+        return serializer.validated_data
+
+    def run(self, lines):
+        batch = []
+        for line_number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            data = self.parse_line(line_number, line)
+            if data is None:
+                continue
+            batch.append((line_number, data))
+            if len(batch) >= self.batch_size:
+                self.save_batch(batch)
+                batch = []
+        if batch:
+            self.save_batch(batch)
+        # Ошибки пакетов находятся позже ошибок формата, выводим по порядку
+        self.errors.sort(key=lambda error: error['line'])
+        return {'created': self.created, 'errors': self.errors}
+
+    def get_row_errors(self, data, ingredient_ids, tag_ids, author_ids,
+                       existing_names):
+        errors = {}
+        if data['name'] in existing_names or data['name'] in self.seen_names:
+            errors['name'] = [constants.MESSAGE_ERROR_RECIPE_NAME_EXISTS]
+        if any(ingredient['id'] not in ingredient_ids
+               for ingredient in data['ingredients']):
+            errors['ingredients'] = [constants.NON_EXISTENT_ELEMENTS]
+        if any(tag_id not in tag_ids for tag_id in data['tags']):
+            errors['tags'] = [constants.NON_EXISTENT_ELEMENTS]
+        if data['author_id'] is None:
+            errors['author'] = [constants.MESSAGE_ERROR_AUTHOR_REQUIRED]
+        elif data['author_id'] not in author_ids:
+            errors['author'] = [constants.NON_EXISTENT_ELEMENTS]
+        return errors
+
+    def save_batch(self, batch):
+        default_author_id = self.author.pk if self.author else None
+        for _, data in batch:
+            author_id = data.pop('author', None)
+            if not self.use_row_author or author_id is None:
+                author_id = default_author_id
+            data['author_id'] = author_id
+        ingredient_ids = set(Ingredient.objects.filter(
+            pk__in={
+                ingredient['id']
+                for _, data in batch for ingredient in data['ingredients']
+            },
+        ).values_list('pk', flat=True))
+        tag_ids = set(Tag.objects.filter(
+            pk__in={tag_id for _, data in batch for tag_id in data['tags']},
+        ).values_list('pk', flat=True))
+        author_ids = set(User.objects.filter(
+            pk__in={data['author_id'] for _, data in batch},
+        ).values_list('pk', flat=True))
+        existing_names = set(Recipe.objects.filter(
+            name__in=[data['name'] for _, data in batch],
+        ).values_list('name', flat=True))
+        rows = []
+        for line_number, data in batch:
+            errors = self.get_row_errors(
+                data, ingredient_ids, tag_ids, author_ids, existing_names)
+            if errors:
+                self.add_error(line_number, errors)
+                continue
+            self.seen_names.add(data['name'])
+            rows.append((line_number, data))
+        if not rows:
+            return
+        try:
+            self.create_recipes([data for _, data in rows])
+        except DatabaseError as error:
+            # Названия из упавшего пакета не заняты и могут прийти снова
+            self.seen_names.difference_update(data['name'] for _, data in rows)
+            for line_number, _ in rows:
+                self.add_error(line_number, {
+                    'non_field_errors': [
+                        constants.MESSAGE_ERROR_IMPORT_BATCH_FAILED.format(
+                            error=error)
+                    ],
+                })
+            return
+        self.created += len(rows)
+
+    @transaction.atomic
+    def create_recipes(self, rows):
+        recipes = Recipe.objects.bulk_create(
+            [
+                Recipe(
+                    name=data['name'],
+                    text=data['text'],
+                    cooking_time=data['cooking_time'],
+                    image=data['image'],
+                    author_id=data['author_id'],
+                )
+                for data in rows
+            ],
+            batch_size=self.batch_size,
+        )
+        features = connections[Recipe.objects.db].features
+        if not features.can_return_rows_from_bulk_insert:
+            # SQLite не возвращает id вставленных строк, названия уникальны
+            recipe_ids = dict(Recipe.objects.filter(
+                name__in=[recipe.name for recipe in recipes],
+            ).values_list('name', 'pk'))
+            for recipe in recipes:
+                recipe.pk = recipe_ids[recipe.name]
+        RecipeIngredient.objects.bulk_create(
+            [
+                RecipeIngredient(
+                    recipe_id=recipe.pk,
+                    ingredient_id=ingredient['id'],
+                    amount=ingredient['amount'],
+                )
+                for recipe, data in zip(recipes, rows)
+                for ingredient in data['ingredients']
+            ],
+            batch_size=self.batch_size,
+        )
+        Recipe.tags.through.objects.bulk_create(
+            [
+                Recipe.tags.through(recipe_id=recipe.pk, tag_id=tag_id)
+                for recipe, data in zip(recipes, rows)
+                for tag_id in data['tags']
+            ],
+            batch_size=self.batch_size,
+        )
+        authors = Counter(data['author_id'] for data in rows)
+        for author_id, count in authors.items():
+            change_counter(
+                User.objects.filter(pk=author_id), 'recipes_count', count)
+        CatalogueVersion.bump(RECIPES_VERSION, AUTHORS_VERSION)
+
+
+def export_recipes(queryset,
+                   batch_size=constants.RECIPE_EXPORT_BATCH_SIZE):
+    """JSON lines в формате импорта, рецепты читаются пакетами по id."""
+    last_pk = 0
+    while True:
+        recipes = list(
+            queryset.filter(
+                pk__gt=last_pk,
+            ).order_by('pk').values(
+                'pk', 'name', 'text', 'cooking_time', 'image', 'author_id',
+            )[:batch_size]
+        )
+        if not recipes:
+            return
+        recipe_ids = [recipe['pk'] for recipe in recipes]
+        ingredients = {}
+        for recipe_id, ingredient_id, amount in (
+            RecipeIngredient.objects.filter(
+                recipe_id__in=recipe_ids,
+            ).order_by('pk').values_list(
+                'recipe_id', 'ingredient_id', 'amount')
+        ):
+            ingredients.setdefault(recipe_id, []).append(
+                {'id': ingredient_id, 'amount': amount})
+        tags = {}
+        for recipe_id, tag_id in Recipe.tags.through.objects.filter(
+            recipe_id__in=recipe_ids,
+        ).order_by('pk').values_list('recipe_id', 'tag_id'):
+            tags.setdefault(recipe_id, []).append(tag_id)
+        for recipe in recipes:
+            yield json.dumps({
+                'name': recipe['name'],
+                'text': recipe['text'],
+                'cooking_time': recipe['cooking_time'],
+                'image': recipe['image'],
+                'author': recipe['author_id'],
+                'tags': tags.get(recipe['pk'], []),
+                'ingredients': ingredients.get(recipe['pk'], []),
+            }, ensure_ascii=False) + '\n'
+        last_pk = recipe_ids[-1]
@@ -0,0 +1,110 @@
+import bisect
+import threading
+import time
+
+from api.serializers import IngredientModelSerializer, TagModelSerializer
+from foodgram_backend import constants
+from recipes.models import CatalogueVersion, Ingredient, Tag
+
+
+class CatalogueCache:
+    """Сериализованный справочник в памяти процесса.
+
+    Версия справочника сверяется с базой не чаще раза в
+    CATALOGUE_CACHE_CHECK_INTERVAL секунд, в остальное время запросы
+    обслуживаются без обращения к базе.
+    """
+
+    def __init__(self, name, queryset, serializer_class):
+        self.name = name
+        self.queryset = queryset
+        self.serializer_class = serializer_class
+        self.lock = threading.Lock()
+        self.invalidate()
+
+    def invalidate(self):
+        self.snapshot = None
+        self.checked_at = None
+
+    def get_fresh_snapshot(self):
+        snapshot, checked_at = self.snapshot, self.checked_at
+        if snapshot is None or checked_at is None:
+            return None
+        now = time.monotonic()
+        if now - checked_at < constants.CATALOGUE_CACHE_CHECK_INTERVAL:
+            return snapshot
+        if CatalogueVersion.get_version(self.name) != snapshot['version']:
+            return None
+        self.checked_at = now
+        return snapshot
+
+    def get_snapshot(self):
+        snapshot = self.get_fresh_snapshot()
+        if snapshot is not None:
+            return snapshot
+        with self.lock:
+            snapshot = self.get_fresh_snapshot()
+            if snapshot is not None:
+                return snapshot
+            version = CatalogueVersion.get_version(self.name)
+            data = list(
+                self.serializer_class(self.queryset.all(), many=True).data
+            )
+            snapshot = {
+                'version': version,
+                'data': data,
+                'by_id': {item['id']: item for item in data},
+                # Отсортированный индекс названий для поиска по префиксу
+                'names': sorted(
+                    (item['name'].lower(), position)
+                    for position, item in enumerate(data)
+                ),
+            }
+            self.snapshot = snapshot
+            self.checked_at = time.monotonic()
+            return snapshot
+
+    def get_version(self):
+        return self.get_snapshot()['version']
+
+    def get_list(self):
+        return self.get_snapshot()['data']
+
+    def get_item(self, pk):
+        return self.get_snapshot()['by_id'].get(pk)
+
+    def search(self, value, limit):
+        """Совпадения с начала названия, затем вхождения в середине."""
+        snapshot = self.get_snapshot()
+        names = snapshot['names']
+        value = value.lower()
+        prefix_positions = []
+        start = bisect.bisect_left(names, (value,))
+        for name, position in names[start:]:
+            if not name.startswith(value):
+                break
+            prefix_positions.append(position)
+        substring_positions = [
+            position for name, position in names
+            if value in name and not name.startswith(value)
+        ]
+        positions = (
+            sorted(prefix_positions) + sorted(substring_positions)
+        )[:limit]
+        return [snapshot['data'][position] for position in positions]
+
+
+ingredient_cache = CatalogueCache(
+    'ingredient', Ingredient.objects.all(), IngredientModelSerializer)
+tag_cache = CatalogueCache('tag', Tag.objects.all(), TagModelSerializer)
+
+CATALOGUE_CACHES = {
+    Ingredient: ingredient_cache,
+    Tag: tag_cache,
+}
+
+
+def bump_catalogue_version(model):
+    cache = CATALOGUE_CACHES[model]
+    CatalogueVersion.bump(cache.name)
+    cache.invalidate()
@@ -0,0 +1,131 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
+from django.utils import timezone
+from django.utils.cache import (get_conditional_response, patch_vary_headers,
+                                quote_etag)
+from rest_framework import status
+
+from api.catalogue import ingredient_cache, tag_cache
+from foodgram_backend import constants
+from recipes.models import CatalogueVersion, Recipe, RecipeScoreState
+
+User = get_user_model()
+
+RECIPES_VERSION = 'recipe'
+AUTHORS_VERSION = 'author'
+
+
+def get_timestamp_version(value):
+    return value.timestamp() if value else 0
+
+
+def get_recipe_version(recipe_pk):
+    return get_timestamp_version(
+        Recipe.objects.filter(pk=recipe_pk).values_list(
+            'changed', flat=True).first()
+    )
+
+
+def get_user_version(user_pk):
+    # Избранное, корзина и подписки пользователя
+    return get_timestamp_version(
+        User.objects.filter(pk=user_pk).values_list(
+            'relations_changed', flat=True).first()
+    )
+
+
+def get_popularity_version():
+    # Порядок популярных рецептов меняет любое чужое добавление
+    # в избранное: вместо общего счетчика, который пришлось бы обновлять
+    # при каждой записи, ETag меняется раз в RECIPE_POPULARITY_ETAG_INTERVAL
+    return int(time.time() // constants.RECIPE_POPULARITY_ETAG_INTERVAL)
+
+
+class ConditionalGetMixin:
+    """ETag из счетчиков версий: 304 отдается до сериализации данных."""
+
+    def get_etag_versions(self, request):
+        """Значения, при изменении которых меняется ответ."""
+        raise NotImplementedError(
+            f'{type(self).__name__} должен определить get_etag_versions')
+
+    def get_etag(self, request):
+        # Вьюсет создается на каждый запрос: версии читаются один раз
+        # и для ответа, и для ключа кэша числа записей в пагинации
+        if not hasattr(self, '_etag'):
+            versions = self.get_etag_versions(request)
+            self._etag = None
+            if versions is not None:
+                versions = '-'.join(str(version) for version in versions)
+                self._etag = quote_etag(
+                    f'{self.basename}-{self.action}-{versions}')
+        return self._etag
+
+    def get_count_cache_version(self, request):
+        return self.get_etag(request)
+
+    def get_conditional_response(self, request, handler, *args, **kwargs):
+        etag = self.get_etag(request)
+        response = None
+        if etag is not None:
+            response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = handler(request, *args, **kwargs)
+        if etag is not None and response.status_code in (
+                status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED):
+            response['ETag'] = etag
+        patch_vary_headers(response, ('Authorization',))
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.get_conditional_response(
+            request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_conditional_response(
+            request, super().retrieve, *args, **kwargs)
+
+
+class CatalogueConditionalGetMixin(ConditionalGetMixin):
+
+    def get_etag_versions(self, request):
+        return [self.catalogue_cache.get_version()]
+
+
+class RecipeConditionalGetMixin(ConditionalGetMixin):
+
+    def get_ordering_name(self):
+        return None
+
+    def get_etag_versions(self, request):
+        # В ответе есть флаги текущего пользователя, поэтому учитываем
+        # и его версию: избранное, корзину и подписки
+        user_pk = request.user.pk or 0
+        versions = CatalogueVersion.get_versions(
+            [RECIPES_VERSION, AUTHORS_VERSION])
+        if self.action == 'retrieve':
+            try:
+                versions[0] = get_recipe_version(self.kwargs['pk'])
+            except (ValueError, ValidationError):
+                # Неверный id: ответ без ETag, get_object() вернет 404
+                return None
+        # Порядок трендовых рецептов меняет пересчет рейтингов
+        ordering = self.get_ordering_name()
+        if ordering == constants.RECIPE_ORDERING_POPULAR:
+            versions.append(get_popularity_version())
+        elif ordering == constants.RECIPE_ORDERING_TRENDING:
+            versions += RecipeScoreState.get_version()
+        return [user_pk, get_user_version(user_pk)] + versions + [
+            tag_cache.get_version(),
+            ingredient_cache.get_version(),
+        ]
+
+
+def touch_recipes(*recipe_pks):
+    Recipe.objects.filter(pk__in=recipe_pks).update(changed=timezone.now())
+
+
+def touch_user(user_pk):
+    User.objects.filter(pk=user_pk).update(relations_changed=timezone.now())
@@ -0,0 +1,84 @@
+from django.core.cache import cache
+from django.db import connections
+from django.db.models import Q
+
+from foodgram_backend import constants
+from recipes.models import Recipe
+from users.models import Follow
+
+
+def get_followees_cache_key(user):
+    # Подписки меняют relations_changed пользователя, поэтому ключ
+    # устаревает сразу во всех воркерах, без явного сброса кэша
+    return f'followees-{user.pk}-{user.relations_changed.timestamp()}'
+
+
+def get_cached_followee_ids(user):
+    """Id авторов ленты пользователя из короткого кэша."""
+    cache_key = get_followees_cache_key(user)
+    followee_ids = cache.get(cache_key)
+    if followee_ids is None:
+        followee_ids = list(
+            Follow.objects.filter(
+                from_user=user,
+            ).values_list('to_user_id', flat=True)
+        )
+        cache.set(
+            cache_key, followee_ids, constants.FEED_FOLLOWEES_CACHE_TIMEOUT)
+    return followee_ids
+
+
+def get_lateral_feed_page(connection, author_ids, before, limit):
+    # Для каждого автора берется не больше limit последних рецептов
+    # по индексу (author, pub_date), затем списки сливаются: сколько бы
+    # ни было подписок, вся таблица рецептов не сортируется
+    quote_name = connection.ops.quote_name
+    table = quote_name(Recipe._meta.db_table)
+    author_column = quote_name(Recipe._meta.get_field('author').column)
+    before_sql = ''
+    params = [list(author_ids)]
+    if before is not None:
+        before_sql = 'AND (recipe.pub_date, recipe.id) < (%s, %s)'
+        params += list(before)
+    params += [limit, limit]
+    sql = f'''
+        SELECT feed.id, feed.pub_date
+        FROM unnest(%s::bigint[]) AS followee(author_id)
+        CROSS JOIN LATERAL (
+            SELECT recipe.id, recipe.pub_date
+            FROM {table} AS recipe
+            WHERE recipe.{author_column} = followee.author_id {before_sql}
+            ORDER BY recipe.pub_date DESC, recipe.id DESC
+            LIMIT %s
+        ) AS feed
+        ORDER BY feed.pub_date DESC, feed.id DESC
+        LIMIT %s
+    '''
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+
+def get_feed_page(author_ids, before, limit):
+    """Пары (id, pub_date) рецептов ленты, от новых к старым.
+
+    before - пара (pub_date, id) последнего рецепта прошлой страницы.
+    """
+    if not author_ids:
+        return []
+    connection = connections[Recipe.objects.db]
+    if connection.vendor == 'postgresql':
+        return get_lateral_feed_page(connection, author_ids, before, limit)
+    return get_keyset_feed_page(author_ids, before, limit)
+
+
+def get_keyset_feed_page(author_ids, before, limit):
+    queryset = Recipe.objects.filter(author_id__in=author_ids)
+    if before is not None:
+        pub_date, pk = before
+        queryset = queryset.filter(
+            Q(pub_date__lt=pub_date) | Q(pub_date=pub_date, pk__lt=pk))
+    return list(
+        queryset.order_by('-pub_date', '-pk').values_list(
+            'pk', 'pub_date')[:limit]
+    )
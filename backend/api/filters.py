@@ -1,30 +1,122 @@
-from django_filters.rest_framework import (BooleanFilter, CharFilter,
-                                           FilterSet,
-                                           ModelMultipleChoiceFilter)
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connections
+from django.db.models import (Case, Count, Exists, F, FloatField, OuterRef, Q,
+                              Subquery, Value, When)
+from django_filters.rest_framework import (BaseInFilter, BooleanFilter,
+                                           CharFilter, FilterSet,
+                                           ModelMultipleChoiceFilter,
+                                           NumberFilter)
 
-from recipes.models import Ingredient, Recipe, Tag
+from foodgram_backend import constants
+from recipes.models import Recipe, RecipeIngredient, Tag
 
 
-class IngredientFilter(FilterSet):
-    name = CharFilter(field_name='name', lookup_expr='icontains')
-
-    class Meta:
-        model = Ingredient
-        fields = [
-            'name',
-        ]
+class NumberInFilter(BaseInFilter, NumberFilter):
+    pass
 
 
 class RecipeFilter(FilterSet):
 
-    author = CharFilter(field_name='author__id', lookup_expr='icontains')
+    author = NumberInFilter(field_name='author_id', lookup_expr='in')
     tags = ModelMultipleChoiceFilter(
         field_name='tags__slug',
         to_field_name='slug',
         queryset=Tag.objects.all(),
+        method='filter_tags',
     )
     is_in_shopping_cart = BooleanFilter(method='filter_shopping_cart')
     is_favorited = BooleanFilter(method='filter_is_favorited')
+    search = CharFilter(method='filter_search')
+    ingredients = NumberInFilter(method='filter_ingredients')
+    exclude_ingredients = NumberInFilter(method='filter_exclude_ingredients')
+    # Сколько ингредиентов из ?ingredients= должно совпасть, по умолчанию все
+    ingredients_match = NumberFilter(method='skip_filter')
+
+    def skip_filter(self, queryset, name, value):
+        return queryset
+
+    def filter_ingredients(self, queryset, name, value):
+        # Один сгруппированный подзапрос к RecipeIngredient вместо JOIN
+        # на каждый ингредиент, пара (ingredient, recipe) берется из индекса
+        ingredient_ids = set(value)
+        if not ingredient_ids:
+            return queryset
+        required = len(ingredient_ids)
+        match = self.form.cleaned_data.get('ingredients_match')
+        if match and match > 0:
+            required = min(int(match), required)
+        matched = RecipeIngredient.objects.filter(
+            ingredient_id__in=ingredient_ids,
+        ).values(
+            'recipe_id',
+        ).annotate(
+            ingredients_matched=Count('ingredient_id'),
+        )
+        queryset = queryset.filter(
+            pk__in=matched.filter(
+                ingredients_matched__gte=required,
+            ).values('recipe_id'),
+        )
+        if required == len(ingredient_ids):
+            return queryset
+        # Неполные совпадения: сначала рецепты, где совпало больше
+        return queryset.annotate(
+            ingredients_matched=Subquery(
+                matched.filter(recipe_id=OuterRef('pk')).values(
+                    'ingredients_matched'),
+            ),
+        ).order_by('-ingredients_matched', '-pub_date', 'id')
+
+    def filter_exclude_ingredients(self, queryset, name, value):
+        if not value:
+            return queryset
+        # Некоррелированный подзапрос вычисляется один раз по индексу
+        # (ingredient, recipe), а не для каждой строки рецептов
+        return queryset.exclude(
+            pk__in=RecipeIngredient.objects.filter(
+                ingredient_id__in=set(value),
+            ).values('recipe_id'),
+        )
+
+    def filter_search(self, queryset, name, value):
+        # На PostgreSQL - полнотекстовый поиск по вектору с GIN-индексом
+        # и русской морфологией, на других базах - поиск подстроки
+        if connections[queryset.db].vendor == 'postgresql':
+            query = SearchQuery(
+                value,
+                config=constants.SEARCH_CONFIG,
+                search_type='websearch',
+            )
+            queryset = queryset.filter(
+                search_vector=query,
+            ).annotate(
+                search_rank=SearchRank(F('search_vector'), query),
+            )
+        else:
+            queryset = queryset.filter(
+                Q(name__icontains=value) | Q(text__icontains=value),
+            ).annotate(
+                search_rank=Case(
+                    When(name__icontains=value, then=Value(1.0)),
+                    default=Value(0.0),
+                    output_field=FloatField(),
+                ),
+            )
+        return queryset.order_by('-search_rank', '-pub_date', 'id')
+
+    def filter_tags(self, queryset, name, value):
+        # Теги уже найдены по slug при валидации, фильтруем подзапросом
+        # к промежуточной таблице без JOIN и DISTINCT
+        if not value:
+            return queryset
+        return queryset.filter(
+            Exists(
+                Recipe.tags.through.objects.filter(
+                    recipe=OuterRef('pk'),
+                    tag_id__in=[tag.pk for tag in value],
+                )
+            )
+        )
 
     def filter_shopping_cart(self, queryset, name, value):
         if bool(self.request.user.is_authenticated and value):
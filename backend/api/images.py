@@ -0,0 +1,81 @@
+import io
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.files.base import ContentFile
+from django.db import connections
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from api.conditional import RECIPES_VERSION
+from foodgram_backend import constants
+from recipes.models import CatalogueVersion, Recipe
+
+logger = logging.getLogger(__name__)
+
+executor = ThreadPoolExecutor(
+    max_workers=constants.RECIPE_IMAGE_WORKERS,
+    thread_name_prefix='recipe-image',
+)
+pending_jobs = {}
+pending_jobs_lock = threading.Lock()
+
+
+def render_image_variants(storage, image_name):
+    """Пишет WebP-копии изображения и возвращает их ширины."""
+    with storage.open(image_name) as image_file:
+        image = ImageOps.exif_transpose(Image.open(image_file))
+        image.load()
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+    # Изображение не увеличивается: узкое получает одну копию своей ширины
+    widths = sorted({
+        min(width, image.width) for width in constants.RECIPE_IMAGE_WIDTHS
+    })
+    for width in widths:
+        height = max(1, round(image.height * width / image.width))
+        variant = image.resize((width, height), Image.LANCZOS)
+        buffer = io.BytesIO()
+        variant.save(
+            buffer, 'WEBP', quality=constants.RECIPE_IMAGE_WEBP_QUALITY)
+        variant_name = Recipe.get_image_variant_name(image_name, width)
+        if storage.exists(variant_name):
+            storage.delete(variant_name)
+        storage.save(variant_name, ContentFile(buffer.getvalue()))
+    return widths
+
+
+def process_recipe_image(recipe_pk, image_name):
+    storage = Recipe._meta.get_field('image').storage
+    widths = render_image_variants(storage, image_name)
+    # Пока шла обработка, изображение рецепта могли заменить
+    updated = Recipe.objects.filter(
+        pk=recipe_pk, image=image_name,
+    ).update(
+        image_variants={'name': image_name, 'widths': widths},
+        changed=timezone.now(),
+    )
+    if updated:
+        CatalogueVersion.bump(RECIPES_VERSION)
+
+
+def run_image_job(recipe_pk, image_name):
+    try:
+        process_recipe_image(recipe_pk, image_name)
+    except Exception:
+        logger.exception('Не удалось обработать изображение %s', image_name)
+        raise
+    finally:
+        with pending_jobs_lock:
+            pending_jobs.pop((recipe_pk, image_name), None)
+        connections.close_all()
+
+
+def process_recipe_image_async(recipe_pk, image_name):
+    key = (recipe_pk, image_name)
+    with pending_jobs_lock:
+        if key not in pending_jobs:
+            pending_jobs[key] = executor.submit(
+                run_image_job, recipe_pk, image_name)
+        return pending_jobs[key]
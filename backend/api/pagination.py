@@ -1,7 +1,329 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import binascii
+import hashlib
+import json
+from collections import OrderedDict
+from datetime import datetime
+from functools import partial
+
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator as DjangoPaginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from api.feed import get_feed_page
+from foodgram_backend import constants
 
 
 class PageNumberWithLimitPagination(PageNumberPagination):
     page_size = 6
     page_size_query_param = 'limit'
     max_page_size = 100
+
+
+class CountGetterPaginator(DjangoPaginator):
+    """Paginator с числом записей от пагинации DRF.
+
+    count_getter возвращает пару (число записей, приблизительное ли оно).
+    Приблизительное число может быть меньше настоящего, поэтому страницы
+    от последней по нему и дальше проверяются по точному числу, и больше
+    настоящего, поэтому неполная страница тоже пересчитывает его точно.
+    """
+
+    def __init__(self, object_list, per_page, count_getter, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.count_getter = count_getter
+        self.count_is_approximate = False
+
+    @cached_property
+    def count(self):
+        count, self.count_is_approximate = self.count_getter(
+            self.object_list)
+        return count
+
+    def set_exact_count(self):
+        self.count, self.count_is_approximate = self.count_getter(
+            self.object_list, exact=True)
+        self.__dict__.pop('num_pages', None)
+
+    def page(self, number):
+        try:
+            is_last = int(number) >= self.num_pages
+        except (TypeError, ValueError):
+            is_last = False
+        if is_last and self.count_is_approximate:
+            self.set_exact_count()
+        page = super().page(number)
+        if self.count_is_approximate and len(page) < self.per_page:
+            # Завышенная оценка: на неполной странице число уточняется,
+            # чтобы ссылка next не вела за последнюю страницу
+            self.set_exact_count()
+            self.validate_number(number)
+        return page
+
+
+class CachedCountPagination(PageNumberWithLimitPagination):
+    """Пагинация с кэшированным или оценочным общим числом записей.
+
+    Число записей кэшируется на COUNT_CACHE_TIMEOUT секунд для набора
+    фильтров и пользователя. Если кэша нет и планировщик PostgreSQL
+    оценивает выборку больше COUNT_ESTIMATE_THRESHOLD строк, отдается
+    оценка. Точный подсчет - по параметру ?exact_count=true или при
+    запросе последней по оценке страницы.
+    """
+    exact_count_query_param = 'exact_count'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.view = view
+        self.django_paginator_class = partial(
+            CountGetterPaginator, count_getter=self.get_count)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        response.data['count_is_approximate'] = (
+            self.page.paginator.count_is_approximate)
+        return response
+
+    def get_count_cache_key(self):
+        ignored_params = (
+            self.page_query_param,
+            self.page_size_query_param,
+            self.exact_count_query_param,
+        )
+        params = sorted(
+            (key, value)
+            for key, value in self.request.query_params.lists()
+            if key not in ignored_params
+        )
+        # Версии данных от вьюсета сбрасывают кэш при изменениях
+        get_version = getattr(self.view, 'get_count_cache_version', None)
+        version = get_version(self.request) if get_version else ''
+        key = f'{self.request.path}|{self.request.user.pk}|{params}|{version}'
+        return 'page-count-' + hashlib.md5(key.encode()).hexdigest()
+
+    def get_estimated_count(self, queryset):
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql':
+            return None
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+        return plan[0]['Plan']['Plan Rows']
+
+    def get_count(self, queryset, exact=False):
+        """Число записей и признак того, что оно приблизительное."""
+        cache_key = self.get_count_cache_key()
+        if exact or self.request.query_params.get(
+                self.exact_count_query_param) in ('1', 'true', 'True'):
+            count = queryset.count()
+            cache.set(cache_key, (count, False), constants.COUNT_CACHE_TIMEOUT)
+            return count, False
+        # В кэше вместе с числом хранится, было ли оно оценкой
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached
+        count = self.get_estimated_count(queryset)
+        is_approximate = (
+            count is not None and count > constants.COUNT_ESTIMATE_THRESHOLD)
+        if not is_approximate:
+            count = queryset.count()
+        cache.set(
+            cache_key, (count, is_approximate), constants.COUNT_CACHE_TIMEOUT)
+        return count, is_approximate
+
+
+class KeysetCursorPagination(BasePagination):
+    """Курсорная пагинация по составному ключу из полей ordering.
+
+    Курсор хранит значения всех полей сортировки крайней записи страницы,
+    соседняя страница выбирается условием (f1, f2, ...) > (v1, v2, ...)
+    без OFFSET, поэтому глубина листания не влияет на стоимость запроса.
+    """
+    page_size = 6
+    page_size_query_param = 'limit'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Неверный курсор.'
+    ordering = ('id',)
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get_ordering_fields(self):
+        return [
+            (name.lstrip('-'), name.startswith('-')) for name in self.ordering
+        ]
+
+    def encode_cursor(self, values, reverse=False):
+        values = [
+            value.isoformat() if isinstance(value, datetime) else value
+            for value in values
+        ]
+        value = json.dumps([values, reverse], ensure_ascii=False)
+        return base64.urlsafe_b64encode(value.encode()).decode()
+
+    def decode_cursor(self, request, model):
+        """Значения полей сортировки и направление или None."""
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            values, reverse = json.loads(
+                base64.urlsafe_b64decode(encoded.encode()).decode())
+            fields = self.get_ordering_fields()
+            if len(values) != len(fields):
+                raise ValueError
+            values = [
+                model._meta.get_field(name).to_python(value)
+                for (name, _), value in zip(fields, values)
+            ]
+        except (binascii.Error, TypeError, ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        return values, bool(reverse)
+
+    def get_keyset_filter(self, values, reverse):
+        condition = Q()
+        equal = {}
+        for (name, descending), value in zip(
+                self.get_ordering_fields(), values):
+            lookup = 'gt' if descending == reverse else 'lt'
+            condition |= Q(**equal, **{f'{name}__{lookup}': value})
+            equal[name] = value
+        return condition
+
+    def get_row_values(self, row):
+        return [getattr(row, name) for name, _ in self.get_ordering_fields()]
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+        cursor = self.decode_cursor(request, queryset.model)
+        reverse = bool(cursor and cursor[1])
+        if cursor is not None:
+            queryset = queryset.filter(self.get_keyset_filter(*cursor))
+        # Страница назад читается в обратном порядке и разворачивается
+        rows = list(queryset.order_by(*[
+            f'-{name}' if descending != reverse else name
+            for name, descending in self.get_ordering_fields()
+        ])[:page_size + 1])
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        if reverse:
+            rows.reverse()
+        self.next_cursor = self.previous_cursor = None
+        if rows and (reverse or has_more):
+            self.next_cursor = self.encode_cursor(
+                self.get_row_values(rows[-1]))
+        if rows and (has_more if reverse else cursor is not None):
+            self.previous_cursor = self.encode_cursor(
+                self.get_row_values(rows[0]), reverse=True)
+        return rows
+
+    def get_link(self, cursor):
+        if cursor is None:
+            return None
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.cursor_query_param,
+            cursor,
+        )
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_link(self.next_cursor)),
+            ('previous', self.get_link(self.previous_cursor)),
+            ('results', data),
+        ]))
+
+
+class RecipeCursorPagination(KeysetCursorPagination):
+    ordering = ('pub_date', 'name', 'id')
+
+
+class UserCursorPagination(KeysetCursorPagination):
+    ordering = ('username', 'id')
+
+
+class PageNumberOrCursorPagination(CachedCountPagination):
+    """Постраничная пагинация, по запросу - курсорная.
+
+    Курсорный режим включается параметром ?pagination=cursor или
+    переданным ?cursor= и не считает общее число записей.
+    """
+    cursor_pagination_class = RecipeCursorPagination
+    pagination_mode_query_param = 'pagination'
+
+    def is_cursor_mode(self, request):
+        return bool(
+            request.query_params.get(self.pagination_mode_query_param)
+            == 'cursor'
+            or self.cursor_pagination_class.cursor_query_param
+            in request.query_params
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_paginator = None
+        if not self.is_cursor_mode(request):
+            return super().paginate_queryset(queryset, request, view)
+        self.cursor_paginator = self.cursor_pagination_class()
+        return self.cursor_paginator.paginate_queryset(
+            queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is None:
+            return super().get_paginated_response(data)
+        return self.cursor_paginator.get_paginated_response(data)
+
+
+class UserPageNumberOrCursorPagination(PageNumberOrCursorPagination):
+    cursor_pagination_class = UserCursorPagination
+
+
+class FeedCursorPagination(KeysetCursorPagination):
+    """Курсорная пагинация ленты подписок, от новых рецептов к старым.
+
+    Страница собирается из последних рецептов каждого автора, id авторов
+    отдает метод вьюсета get_feed_author_ids. Курсор - пара (pub_date, id)
+    последнего рецепта страницы, листание только вперед.
+    """
+    ordering = ('-pub_date', '-id')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+        cursor = self.decode_cursor(request, queryset.model)
+        if cursor is not None and cursor[1]:
+            raise NotFound(self.invalid_cursor_message)
+        rows = get_feed_page(
+            view.get_feed_author_ids(),
+            cursor and cursor[0],
+            page_size + 1,
+        )
+        self.next_cursor = None
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            pk, pub_date = rows[-1]
+            self.next_cursor = self.encode_cursor([pub_date, pk])
+        recipes = queryset.in_bulk([pk for pk, _ in rows])
+        return [recipes[pk] for pk, _ in rows if pk in recipes]
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_link(self.next_cursor)),
+            ('results', data),
+        ]))
@@ -0,0 +1,38 @@
+from rest_framework.exceptions import NotAcceptable
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+
+class ShoppingListRenderer(BaseRenderer):
+    # Сам файл отдается вьюсетом напрямую, рендерер нужен для выбора формата
+    # по ?format= и заголовку Accept. Ошибки вьюсет выводит JSONRenderer
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return JSONRenderer().render(data)
+
+
+class PDFShoppingListRenderer(ShoppingListRenderer):
+    media_type = 'application/pdf'
+    format = 'pdf'
+    charset = None
+
+
+class TXTShoppingListRenderer(ShoppingListRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+
+class CSVShoppingListRenderer(ShoppingListRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+
+class ShoppingListContentNegotiation(DefaultContentNegotiation):
+    # Клиенты, которые не просят txt или csv, получают PDF, как и раньше
+    def select_renderer(self, request, renderers, format_suffix=None):
+        try:
+            return super().select_renderer(
+                request, renderers, format_suffix)
+        except NotAcceptable:
+            return renderers[0], renderers[0].media_type
@@ -1,32 +1,89 @@
 import base64
+import posixpath
 
 from django.contrib.auth import get_user_model
 from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models import prefetch_related_objects
 from rest_framework import serializers
+from rest_framework.relations import MANY_RELATION_KWARGS
 from rest_framework.serializers import ValidationError
 from rest_framework.validators import UniqueTogetherValidator
 
 from foodgram_backend import constants
 from recipes.models import (Cart, Favorite, Ingredient, Recipe,
-                            RecipeIngredient, Tag)
+                            RecipeIngredient, ShoppingListItem, Tag)
 from users.models import Follow
 
 User = get_user_model()
 
 
+def get_followee_ids(request):
+    """Id авторов, на которых подписан пользователь, - один раз на запрос."""
+    followee_ids = getattr(request, '_followee_ids', None)
+    if followee_ids is None:
+        followee_ids = set(
+            Follow.objects.filter(
+                from_user=request.user,
+            ).values_list('to_user_id', flat=True)
+        )
+        request._followee_ids = followee_ids
+    return followee_ids
+
+
+def get_recipes_limit(request):
+    """Значение ?recipes_limit=, None - если не задано или неверно."""
+    try:
+        recipes_limit = int(request.query_params.get('recipes_limit'))
+    except (TypeError, ValueError):
+        return None
+    if recipes_limit < 0:
+        return None
+    return recipes_limit
+
+
 class LimitedRecipeSerializer(serializers.ListSerializer):
     def to_representation(self, data):
-        recipes_limit = self.context['request'].query_params.get(
-            'recipes_limit')
-        if recipes_limit:
-            try:
-                data = data.all()[:int(recipes_limit)]
-            except ValueError:
-                pass
+        recipes_limit = get_recipes_limit(self.context['request'])
+        if recipes_limit is not None:
+            data = data.all()[:recipes_limit]
         return super().to_representation(data)
 
 
-class RecipeToFavoriteModelSerializer(serializers.ModelSerializer):
+class RecipeImageVariantsSerializer(serializers.ModelSerializer):
+    """Ссылки на WebP-копии изображения, пока их нет - на оригинал."""
+
+    image_thumb = serializers.SerializerMethodField()
+    image_srcset = serializers.SerializerMethodField()
+
+    def get_media_url(self, obj, name):
+        url = obj.image.storage.url(name)
+        request = self.context.get('request')
+        if request is None:
+            return url
+        return request.build_absolute_uri(url)
+
+    def get_image_thumb(self, obj):
+        if not obj.image:
+            return None
+        widths = obj.get_image_variant_widths()
+        if not widths:
+            return self.get_media_url(obj, obj.image.name)
+        return self.get_media_url(
+            obj, Recipe.get_image_variant_name(obj.image.name, widths[0]))
+
+    def get_image_srcset(self, obj):
+        return ', '.join(
+            '{} {}w'.format(
+                self.get_media_url(
+                    obj, Recipe.get_image_variant_name(obj.image.name, width)),
+                width,
+            )
+            for width in obj.get_image_variant_widths()
+        )
+
+
+class RecipeToFavoriteModelSerializer(RecipeImageVariantsSerializer):
 
     class Meta:
         model = Recipe
@@ -34,6 +91,8 @@ class RecipeToFavoriteModelSerializer(serializers.ModelSerializer):
             'id',
             'name',
             'image',
+            'image_thumb',
+            'image_srcset',
             'cooking_time',
         )
         list_serializer_class = LimitedRecipeSerializer
@@ -58,10 +117,7 @@ class UserModelSerializer(serializers.ModelSerializer):
         return bool(
             self.context.get('request')
             and self.context['request'].user.is_authenticated
-            and Follow.objects.filter(
-                from_user=obj,
-                to_user=self.context['request'].user,
-            ).exists()
+            and obj.pk in get_followee_ids(self.context['request'])
         )
 
 
@@ -69,15 +125,11 @@ class UserSubscriptionsModelSerializer(UserModelSerializer):
 
     recipes = RecipeToFavoriteModelSerializer(many=True, read_only=True)
 
-    recipes_count = serializers.SerializerMethodField(read_only=True)
-
     class Meta(UserModelSerializer.Meta):
         fields = UserModelSerializer.Meta.fields + (
             'recipes', 'recipes_count',
         )
-
-    def get_recipes_count(self, obj):
-        return obj.recipes.count()
+        read_only_fields = ('recipes_count',)
 
 
 class UserAuthorSubscribeSerializer(serializers.ModelSerializer):
@@ -138,25 +190,19 @@ class AddToShoppingCart(serializers.ModelSerializer):
     class Meta:
         model = Cart
         fields = (
-            'recipes',
+            'recipe',
             'owner',
         )
-
-    def validate(self, data):
-        self.recipes = data['recipes']
-        # recipes = data['recipes']
-        user = data['owner']
-        if Cart.objects.filter(owner=user, recipes__in=self.recipes).exists():
-            raise ValidationError(
-                {'errors': constants.MESSAGE_ERROR_RECIPE_ALREADY_IN_CART}
-            )
-        return data
+        validators = [
+            UniqueTogetherValidator(
+                queryset=Cart.objects.all(),
+                fields=('owner', 'recipe',),
+                message=constants.MESSAGE_ERROR_RECIPE_ALREADY_IN_CART
+            ),
+        ]
 
     def to_representation(self, value):
-        # recipe = Recipe.objects.get(
-        #     pk=self.initial_data['recipes'][constants.ZERO_INDEX])
-        recipe = self.recipes[constants.ZERO_INDEX]
-        serializer = RecipeToFavoriteModelSerializer(recipe)
+        serializer = RecipeToFavoriteModelSerializer(value.recipe)
         serializer.context['request'] = self.context['request']
         return serializer.data
 
@@ -209,7 +255,7 @@ class RecipeIngredientModelSerializer(serializers.ModelSerializer):
         return obj.ingredient.measurement_unit
 
 
-class RecipeReadModelSerializer(serializers.ModelSerializer):
+class RecipeReadModelSerializer(RecipeImageVariantsSerializer):
     author = UserModelSerializer(
         many=False,
     )
@@ -237,11 +283,16 @@ class RecipeReadModelSerializer(serializers.ModelSerializer):
             'is_in_shopping_cart',
             'name',
             'image',
+            'image_thumb',
+            'image_srcset',
             'text',
             'cooking_time',
         )
 
     def get_is_favorited(self, obj):
+        # Значение уже посчитано в queryset вьюсета через Exists()
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         return bool(
             self.context.get('request')
             and self.context['request'].user.is_authenticated
@@ -252,29 +303,113 @@ class RecipeReadModelSerializer(serializers.ModelSerializer):
         )
 
     def get_is_in_shopping_cart(self, obj):
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         return bool(
             self.context.get('request')
             and self.context['request'].user.is_authenticated
             and Cart.objects.filter(
-                recipes=obj,
+                recipe=obj,
                 owner=self.context['request'].user,
             ).exists()
         )
 
 
 class Base64ImageField(serializers.ImageField):
+    default_error_messages = {
+        'too_large': constants.MESSAGE_ERROR_IMAGE_TOO_LARGE,
+    }
+
     def to_internal_value(self, data):
         if isinstance(data, str) and data.startswith('data:image'):
-            format, imgstr = data.split(';base64,')
+            if ';base64,' not in data:
+                self.fail('invalid')
+            format, imgstr = data.split(';base64,', 1)
+            # Размер известен до декодирования: 4 символа base64 - 3 байта
+            if len(imgstr) * 3 // 4 > constants.MAX_IMAGE_UPLOAD_SIZE:
+                self.fail('too_large')
             ext = format.split('/')[-1]
 
             data = ContentFile(base64.b64decode(imgstr), name='temp.' + ext)
+        elif getattr(data, 'size', 0) > constants.MAX_IMAGE_UPLOAD_SIZE:
+            self.fail('too_large')
 
         return super().to_internal_value(data)
 
 
+class BulkManyRelatedField(serializers.ManyRelatedField):
+    """Список первичных ключей, объекты читаются одним in_bulk."""
+
+    @staticmethod
+    def to_pk(value):
+        # Как PrimaryKeyRelatedField: только целые числа и строки из цифр,
+        # int() принял бы и True, и 1.7
+        if isinstance(value, bool) or not isinstance(value, (int, str)):
+            raise TypeError(value)
+        if isinstance(value, str) and not value.isdigit():
+            raise ValueError(value)
+        return int(value)
+
+    def to_internal_value(self, data):
+        if isinstance(data, str) or not hasattr(data, '__iter__'):
+            self.fail('not_a_list', input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail('empty')
+        child = self.child_relation
+        pks = []
+        errors = {}
+        for index, pk in enumerate(data):
+            try:
+                pks.append(self.to_pk(pk))
+            except (TypeError, ValueError):
+                errors[index] = [
+                    child.error_messages['incorrect_type'].format(
+                        data_type=type(pk).__name__)
+                ]
+        if errors:
+            raise ValidationError(errors)
+        objects = child.get_queryset().in_bulk(pks)
+        errors = {
+            index: [constants.NON_EXISTENT_ELEMENTS]
+            for index, pk in enumerate(pks) if pk not in objects
+        }
+        if errors:
+            raise ValidationError(errors)
+        return [objects[pk] for pk in pks]
+
+
+class BulkPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        list_kwargs = {'child_relation': cls(*args, **kwargs)}
+        for key in kwargs:
+            if key in MANY_RELATION_KWARGS:
+                list_kwargs[key] = kwargs[key]
+        return BulkManyRelatedField(**list_kwargs)
+
+
+class RecipeIngredientListSerializer(serializers.ListSerializer):
+    """Все ингредиенты рецепта проверяются одним запросом."""
+
+    def to_internal_value(self, data):
+        items = super().to_internal_value(data)
+        ingredients = Ingredient.objects.in_bulk(
+            [item['id'] for item in items])
+        errors = [
+            {} if item['id'] in ingredients
+            else {'id': [constants.NON_EXISTENT_ELEMENTS]}
+            for item in items
+        ]
+        if any(errors):
+            raise ValidationError(errors)
+        for item in items:
+            item['id'] = ingredients[item['id']]
+        return items
+
+
 class ThinRecipeIngredientSerializer(serializers.ModelSerializer):
-    id = serializers.PrimaryKeyRelatedField(queryset=Ingredient.objects.all(),)
+    id = serializers.IntegerField()
 
     class Meta:
         model = RecipeIngredient
@@ -282,11 +417,12 @@ class ThinRecipeIngredientSerializer(serializers.ModelSerializer):
             'id',
             'amount',
         )
+        list_serializer_class = RecipeIngredientListSerializer
 
 
 class RecipeWriteModelSerializer(serializers.ModelSerializer):
 
-    tags = serializers.PrimaryKeyRelatedField(
+    tags = BulkPrimaryKeyRelatedField(
         queryset=Tag.objects.all(),
         many=True,
     )
@@ -349,26 +485,125 @@ class RecipeWriteModelSerializer(serializers.ModelSerializer):
         ingredients_data = validated_data.pop('ingredients')
         validated_data['author'] = self.context['request'].user
         recipe = Recipe.objects.create(**validated_data)
-        recipe.tags.set(tags)
         self.add_ingredients_to_recipe(
             ingredients_data,
             recipe
         )
+        # bulk_create не шлет сигналов: версию рецепта для ETag обновит
+        # m2m_changed от тегов, поэтому теги сохраняются последними
+        recipe.tags.set(tags)
         return recipe
 
+    def update_recipe_ingredients(self, ingredients_data, recipe):
+        # Меняются только отличающиеся строки, остальные не трогаются
+        current = {
+            recipe_ingredient.ingredient_id: recipe_ingredient
+            for recipe_ingredient in RecipeIngredient.objects.filter(
+                recipe=recipe)
+        }
+        amounts = {
+            ingredient['id'].pk: ingredient['amount']
+            for ingredient in ingredients_data
+        }
+        removed_ids = [
+            recipe_ingredient.pk
+            for ingredient_id, recipe_ingredient in current.items()
+            if ingredient_id not in amounts
+        ]
+        changed = []
+        for ingredient_id, amount in amounts.items():
+            recipe_ingredient = current.get(ingredient_id)
+            if recipe_ingredient and recipe_ingredient.amount != amount:
+                recipe_ingredient.amount = amount
+                changed.append(recipe_ingredient)
+        added = [
+            ingredient for ingredient in ingredients_data
+            if ingredient['id'].pk not in current
+        ]
+        if removed_ids:
+            RecipeIngredient.objects.filter(pk__in=removed_ids).delete()
+        if changed:
+            RecipeIngredient.objects.bulk_update(changed, ['amount'])
+        if added:
+            self.add_ingredients_to_recipe(added, recipe)
+        return bool(removed_ids or changed or added)
+
+    @transaction.atomic
     def update(self, instance, validated_data):
         tags_lst = validated_data.pop('tags')
         ingredients_data = validated_data.pop('ingredients')
-        instance.ingredients.clear()
-        self.add_ingredients_to_recipe(
-            ingredients_data,
-            instance
-        )
-        instance.tags.clear()
+        # bulk_update и bulk_create не отправляют сигналы, поэтому списки
+        # покупок после изменения ингредиентов пересчитываются здесь
+        if self.update_recipe_ingredients(ingredients_data, instance):
+            ShoppingListItem.rebuild(
+                User.objects.filter(carts__recipe=instance)
+            )
+        # set сам сравнивает теги и пишет только разницу
         instance.tags.set(tags_lst)
         return super().update(instance, validated_data)
 
     def to_representation(self, value):
+        # Ингредиенты и теги ответа читаются двумя запросами, а не по одному
+        prefetch_related_objects(
+            [value], 'tags', 'recipeingredient_set__ingredient')
         serializer = RecipeReadModelSerializer(value)
         serializer.context['request'] = self.context['request']
         return serializer.data
+
+
+class RecipeImportIngredientSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    amount = serializers.IntegerField(
+        min_value=constants.MIN_VALUE_FOR_VALIDATOR,
+        max_value=constants.MAX_VALUE_FOR_VALIDATOR,
+    )
+
+
+class RecipeImportSerializer(serializers.Serializer):
+    """Строка импорта рецептов.
+
+    Проверяет только саму строку: существование ингредиентов, тегов,
+    автора и занятость названия проверяются сразу для пакета строк.
+    """
+    name = serializers.CharField(max_length=constants.MAX_LENGTH_NAME)
+    text = serializers.CharField()
+    cooking_time = serializers.IntegerField(
+        min_value=constants.MIN_VALUE_FOR_VALIDATOR,
+        max_value=constants.MAX_VALUE_FOR_VALIDATOR,
+    )
+    image = serializers.CharField(max_length=constants.MAX_LENGTH_IMAGE)
+    author = serializers.IntegerField(required=False)
+    tags = serializers.ListField(
+        child=serializers.IntegerField(),
+        allow_empty=False,
+    )
+    ingredients = RecipeImportIngredientSerializer(
+        many=True,
+        allow_empty=False,
+    )
+
+    def validate_image(self, value):
+        # Строка ссылается только на уже загруженное изображение рецепта:
+        # путь без .. внутри каталога изображений, файл есть в хранилище
+        field = Recipe._meta.get_field('image')
+        if (
+            posixpath.normpath(value) != value
+            or not value.startswith(field.upload_to)
+            or not field.storage.exists(value)
+        ):
+            raise ValidationError(constants.MESSAGE_ERROR_IMAGE_NOT_FOUND)
+        return value
+
+    def validate(self, data):
+        ingredient_ids = [
+            ingredient['id'] for ingredient in data['ingredients']
+        ]
+        if len(ingredient_ids) != len(set(ingredient_ids)):
+            raise ValidationError(
+                {'ingredients': constants.REPEATED_INGREDIENTS}
+            )
+        if len(data['tags']) != len(set(data['tags'])):
+            raise ValidationError(
+                {'tags': constants.REPEATED_TAGS}
+            )
+        return data
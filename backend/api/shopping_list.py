@@ -0,0 +1,160 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.utils.crypto import salted_hmac
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import letter
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle
+
+from foodgram_backend import constants
+
+logger = logging.getLogger(__name__)
+
+SHOPPING_LIST_TABLE_STYLE = TableStyle(
+    [
+        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.black),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, -1), constants.FONT_NAME),
+        ('FONTSIZE', (0, 0), (-1, -1), 12),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 5),
+        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black),
+    ]
+)
+
+STATUS_PENDING = 'pending'
+STATUS_READY = 'ready'
+STATUS_FAILED = 'failed'
+# Файлы завершенных задач: PDF и метка ошибки. Метки .pending идущих
+# задач при очистке не удаляются
+FINISHED_JOB_EXTENSIONS = ('.pdf', f'.{STATUS_FAILED}')
+
+executor = ThreadPoolExecutor(
+    max_workers=constants.SHOPPING_LIST_PDF_WORKERS,
+    thread_name_prefix='shopping-list-pdf',
+)
+pending_jobs = {}
+pending_jobs_lock = threading.Lock()
+
+
+def build_pdf_document(ingredient_cart_lst, pdf_file):
+    data_for_output = [
+        [
+            ingrdient['name'],
+            (f'{ingrdient["total_amount"]} '
+             f'{ingrdient["measurement_unit"]}')
+        ]
+        for ingrdient in ingredient_cart_lst
+    ]
+    data_for_output.insert(0, ['Ингредиенты', 'Количество', ])
+    doc = SimpleDocTemplate(pdf_file, pagesize=letter)
+    table = Table(
+        data_for_output,
+        colWidths=constants.COLWIDTHS_VALUE,
+        rowHeights=constants.ROWHEIGHTS_VALUE,
+        repeatRows=1,
+    )
+    table.setStyle(SHOPPING_LIST_TABLE_STYLE)
+    doc.build([table])
+
+
+def get_pdf_token(user, ingredient_cart_lst):
+    # Токен зависит от содержимого списка: неизменная корзина - тот же файл
+    content = ';'.join(
+        f'{ingredient["name"]}:{ingredient["total_amount"]}'
+        for ingredient in ingredient_cart_lst
+    )
+    return salted_hmac(
+        'api.shopping_list', f'{user.pk}|{content}').hexdigest()
+
+
+def get_pdf_dir(user):
+    return os.path.join(
+        settings.MEDIA_ROOT, constants.SHOPPING_LIST_PDF_DIR, str(user.pk))
+
+
+def get_pdf_path(user, token):
+    return os.path.join(get_pdf_dir(user), f'{token}.pdf')
+
+
+def get_job_status_path(user, token, job_status):
+    return os.path.join(get_pdf_dir(user), f'{token}.{job_status}')
+
+
+def set_job_status(user, token, job_status=None):
+    """Оставляет у задачи только метку job_status, без него - ни одной."""
+    for marker_status in (STATUS_PENDING, STATUS_FAILED):
+        path = get_job_status_path(user, token, marker_status)
+        if marker_status == job_status:
+            open(path, 'w').close()
+        elif os.path.exists(path):
+            os.remove(path)
+
+
+def render_pdf_file(user, token, ingredient_cart_lst):
+    pdf_dir = get_pdf_dir(user)
+    pdf_path = get_pdf_path(user, token)
+    tmp_path = f'{pdf_path}.{threading.get_ident()}.tmp'
+    try:
+        with open(tmp_path, 'wb') as pdf_file:
+            build_pdf_document(ingredient_cart_lst, pdf_file)
+        # Готовый файл появляется атомарно, недописанный не отдается
+        os.replace(tmp_path, pdf_path)
+        set_job_status(user, token)
+    except Exception:
+        logger.exception('Не удалось сформировать список покупок %s', token)
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        set_job_status(user, token, STATUS_FAILED)
+        raise
+    finally:
+        with pending_jobs_lock:
+            pending_jobs.pop(token, None)
+    # Завершенные задачи прошлых версий корзины больше не нужны, более
+    # новые файлы мог оставить параллельный запрос
+    finished = os.path.getmtime(pdf_path)
+    for filename in os.listdir(pdf_dir):
+        name, extension = os.path.splitext(filename)
+        path = os.path.join(pdf_dir, filename)
+        if (
+            name != token
+            and extension in FINISHED_JOB_EXTENSIONS
+            and os.path.getmtime(path) <= finished
+        ):
+            os.remove(path)
+
+
+def get_pdf_status(user, token):
+    """Статус задачи или None, если задачи с таким токеном нет."""
+    if os.path.exists(get_pdf_path(user, token)):
+        return STATUS_READY
+    if os.path.exists(get_job_status_path(user, token, STATUS_FAILED)):
+        return STATUS_FAILED
+    try:
+        started = os.path.getmtime(
+            get_job_status_path(user, token, STATUS_PENDING))
+    except FileNotFoundError:
+        return None
+    # Воркер мог завершиться посреди генерации, не оставив метку ошибки
+    if time.time() - started > constants.SHOPPING_LIST_PDF_JOB_TIMEOUT:
+        return STATUS_FAILED
+    return STATUS_PENDING
+
+
+def render_pdf_async(user, ingredient_cart_lst):
+    token = get_pdf_token(user, ingredient_cart_lst)
+    if get_pdf_status(user, token) == STATUS_READY:
+        return token, STATUS_READY
+    with pending_jobs_lock:
+        if token not in pending_jobs:
+            # Задача, завершившаяся ошибкой, запускается заново
+            os.makedirs(get_pdf_dir(user), exist_ok=True)
+            set_job_status(user, token, STATUS_PENDING)
+            pending_jobs[token] = executor.submit(
+                render_pdf_file, user, token, ingredient_cart_lst)
+    return token, STATUS_PENDING
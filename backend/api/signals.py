@@ -0,0 +1,86 @@
+from functools import partial
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from api.catalogue import bump_catalogue_version
+from api.conditional import (AUTHORS_VERSION, RECIPES_VERSION, touch_recipes,
+                             touch_user)
+from api.images import process_recipe_image_async
+from recipes.models import (Cart, CatalogueVersion, Favorite, Ingredient,
+                            Recipe, RecipeIngredient, Tag)
+from users.models import Follow
+
+User = get_user_model()
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def update_catalogue_version(sender, **kwargs):
+    bump_catalogue_version(sender)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def bump_recipe_version(sender, instance, **kwargs):
+    # Дату изменения самого рецепта обновляет save()
+    CatalogueVersion.bump(RECIPES_VERSION)
+
+
+@receiver(post_save, sender=RecipeIngredient)
+@receiver(post_delete, sender=RecipeIngredient)
+def bump_recipe_ingredient_version(sender, instance, **kwargs):
+    CatalogueVersion.bump(RECIPES_VERSION)
+    touch_recipes(instance.recipe_id)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def bump_recipe_m2m_version(sender, instance, action, reverse, pk_set,
+                            **kwargs):
+    if not action.startswith('post_'):
+        return
+    CatalogueVersion.bump(RECIPES_VERSION)
+    touch_recipes(*((pk_set or []) if reverse else [instance.pk]))
+
+
+@receiver(post_save, sender=User)
+def bump_author_version(sender, instance, update_fields=None, **kwargs):
+    # Вход пользователя обновляет только last_login, на рецепты не влияет
+    if update_fields and set(update_fields) == {'last_login'}:
+        return
+    CatalogueVersion.bump(AUTHORS_VERSION)
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_delete, sender=Favorite)
+def bump_user_version(sender, instance, **kwargs):
+    touch_user(instance.user_id)
+
+
+@receiver(post_save, sender=Cart)
+@receiver(post_delete, sender=Cart)
+def bump_owner_version(sender, instance, **kwargs):
+    touch_user(instance.owner_id)
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def bump_follower_version(sender, instance, **kwargs):
+    touch_user(instance.from_user_id)
+
+
+@receiver(post_save, sender=Recipe)
+def schedule_image_processing(sender, instance, raw=False, **kwargs):
+    # Копии делаются вне запроса и только после фиксации транзакции,
+    # когда оригинал уже сохранен. Рецепты из фикстур и импорта
+    # обрабатывает команда process_recipe_images
+    if raw or not instance.image or (
+            instance.image_variants.get('name') == instance.image.name):
+        return
+    transaction.on_commit(partial(
+        process_recipe_image_async, instance.pk, instance.image.name))
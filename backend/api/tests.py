@@ -1,6 +1,100 @@
+import base64
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+from concurrent import futures
 from http import HTTPStatus
+from unittest import mock, skipUnless
 
-from django.test import TestCase
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import DatabaseError, connection
+from django.db.models import F
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APIClient
+
+from api import feed, images, shopping_list
+from api.bulk import RecipeImporter
+from api.catalogue import ingredient_cache, tag_cache
+from api.pagination import CachedCountPagination
+from foodgram_backend import constants
+from recipes.models import (Cart, Favorite, Ingredient, Recipe,
+                            RecipeIngredient, RecipeScore, RecipeScoreState,
+                            ShoppingListItem, Tag)
+from users.models import Follow
+
+User = get_user_model()
+
+TEST_MEDIA_ROOT = tempfile.mkdtemp()
+TEST_IMAGE = (
+    'data:image/png;base64,'
+    'iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNk+M9QDwADhgGA'
+    'WjR9awAAAABJRU5ErkJggg=='
+)
+
+
+class SynchronousExecutor:
+    """Пул без потоков: задачи выполняются в потоке теста по run().
+
+    Задача не запускается внутри submit, потому что его вызывают под
+    блокировкой, которую задача берет при завершении.
+    """
+
+    def __init__(self):
+        self.jobs = []
+
+    def submit(self, function, *args):
+        future = futures.Future()
+        self.jobs.append((future, function, args))
+        return future
+
+    def run(self):
+        while self.jobs:
+            future, function, args = self.jobs.pop(0)
+            try:
+                future.set_result(function(*args))
+            except Exception as error:
+                future.set_exception(error)
+
+
+USER_NAMES = {
+    'reader': ('Читатель', 'Читателев'),
+    'buyer': ('Покупатель', 'Покупателев'),
+}
+
+
+def create_user(username):
+    first_name, last_name = USER_NAMES.get(username, ('Автор', 'Авторов'))
+    return User.objects.create_user(
+        email=f'{username}@test.ru',
+        username=username,
+        first_name=first_name,
+        last_name=last_name,
+        password='password',
+    )
+
+
+class AuthenticatedAPITestCase(TestCase):
+    """Запросы к API от имени cls.user, кэш очищается перед каждым тестом."""
+    username = 'reader'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user(cls.username)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
 
 
 class RecipesAPITestCase(TestCase):
@@ -9,3 +103,1165 @@ class RecipesAPITestCase(TestCase):
         """Проверка доступности списка задач."""
         response = self.client.get('/api/recipes/')
         self.assertEqual(response.status_code, HTTPStatus.OK)
+
+
+class RecipesQueryCountTestCase(AuthenticatedAPITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.author = create_user('author')
+        cls.tag = Tag.objects.create(name='Завтрак', slug='breakfast')
+        cls.ingredient = Ingredient.objects.create(
+            name='мука', measurement_unit='г')
+
+    def create_recipes(self, count):
+        for number in range(Recipe.objects.count(),
+                            Recipe.objects.count() + count):
+            recipe = Recipe.objects.create(
+                name=f'Рецепт {number}',
+                text='Описание',
+                author=self.author,
+                cooking_time=10,
+                image='recipes/images/1_.jpg',
+            )
+            recipe.tags.set([self.tag])
+            RecipeIngredient.objects.create(
+                recipe=recipe, ingredient=self.ingredient, amount=100)
+            if number % 2:
+                Favorite.objects.create(user=self.user, recipe=recipe)
+                Cart.objects.create(owner=self.user, recipe=recipe)
+
+    def get_list_queries(self, limit):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(f'/api/recipes/?limit={limit}')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        return response, context.captured_queries
+
+    def test_flags_are_annotated(self):
+        """Флаги избранного и корзины берутся из аннотаций queryset."""
+        self.create_recipes(4)
+        response, _ = self.get_list_queries(4)
+        flags = {
+            recipe['name']: (
+                recipe['is_favorited'], recipe['is_in_shopping_cart'])
+            for recipe in response.json()['results']
+        }
+        self.assertEqual(flags['Рецепт 0'], (False, False))
+        self.assertEqual(flags['Рецепт 1'], (True, True))
+
+    def test_list_query_count_does_not_depend_on_page_size(self):
+        """Запросы флагов избранного и корзины не зависят от страницы."""
+        def count_flag_queries(queries):
+            return len([
+                query for query in queries
+                if 'recipes_favorite' in query['sql']
+                or 'recipes_cart' in query['sql']
+            ])
+
+        self.create_recipes(2)
+        _, small_page_queries = self.get_list_queries(2)
+        self.create_recipes(8)
+        _, big_page_queries = self.get_list_queries(10)
+        self.assertEqual(
+            count_flag_queries(small_page_queries),
+            count_flag_queries(big_page_queries),
+        )
+
+    def test_list_query_count_with_subscription(self):
+        """Число запросов к списку рецептов не зависит от страницы."""
+        Follow.objects.create(from_user=self.user, to_user=self.author)
+        self.create_recipes(2)
+        response, small_page_queries = self.get_list_queries(2)
+        self.assertTrue(
+            response.json()['results'][0]['author']['is_subscribed'])
+        self.create_recipes(8)
+        _, big_page_queries = self.get_list_queries(10)
+        self.assertEqual(len(small_page_queries), len(big_page_queries))
+
+    def test_recipes_conditional_get(self):
+        """Список и рецепт отдают ETag и 304 для неизменных данных."""
+        self.create_recipes(2)
+        recipe = Recipe.objects.first()
+        for url in ('/api/recipes/', f'/api/recipes/{recipe.pk}/'):
+            response = self.client.get(url)
+            etag = response['ETag']
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+            Favorite.objects.get_or_create(user=self.user, recipe=recipe)
+            Favorite.objects.filter(user=self.user, recipe=recipe).delete()
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, HTTPStatus.OK)
+            self.assertNotEqual(response['ETag'], etag)
+        # Неверный id не ломает расчет ETag, ответ - обычный 404
+        response = self.client.get('/api/recipes/abc/')
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+        self.assertFalse(response.has_header('ETag'))
+
+    def test_recipes_cursor_pagination(self):
+        """Курсорная пагинация проходит все рецепты без подсчета записей."""
+        self.create_recipes(5)
+        url = '/api/recipes/?pagination=cursor&limit=2'
+        names = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, HTTPStatus.OK)
+            self.assertNotIn('count', response.json())
+            names += [recipe['name'] for recipe in response.json()['results']]
+            url = response.json()['next']
+        self.assertEqual(names, [f'Рецепт {number}' for number in range(5)])
+
+    def test_recipes_cursor_pagination_keyset(self):
+        """Курсор - ключ (pub_date, name, id): равные даты не теряются."""
+        self.create_recipes(5)
+        Recipe.objects.update(pub_date=Recipe.objects.first().pub_date)
+        url = '/api/recipes/?pagination=cursor&limit=2'
+        pages = []
+        while url:
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(url)
+            self.assertFalse(any(
+                'OFFSET' in query['sql'] for query in context.captured_queries
+            ))
+            pages.append(
+                [recipe['name'] for recipe in response.json()['results']])
+            previous = response.json()['previous']
+            url = response.json()['next']
+        self.assertEqual(
+            sum(pages, []), [f'Рецепт {number}' for number in range(5)])
+        response = self.client.get(previous)
+        self.assertEqual(
+            [recipe['name'] for recipe in response.json()['results']],
+            pages[-2],
+        )
+
+    def test_page_count_cached(self):
+        """Общее число рецептов берется из кэша до изменения данных."""
+        def count_queries(queries):
+            return len([
+                query for query in queries if 'COUNT(' in query['sql']
+            ])
+
+        self.create_recipes(3)
+        response, queries = self.get_list_queries(2)
+        self.assertEqual(response.json()['count'], 3)
+        self.assertFalse(response.json()['count_is_approximate'])
+        self.assertEqual(count_queries(queries), 1)
+        response, queries = self.get_list_queries(2)
+        self.assertFalse(response.json()['count_is_approximate'])
+        self.assertEqual(count_queries(queries), 0)
+        self.create_recipes(1)
+        response, _ = self.get_list_queries(2)
+        self.assertEqual(response.json()['count'], 4)
+        response = self.client.get('/api/recipes/?limit=2&exact_count=true')
+        self.assertFalse(response.json()['count_is_approximate'])
+
+    def test_estimated_count_lower_than_real(self):
+        """Заниженная оценка не обрывает листание и не дает 404."""
+        self.create_recipes(5)
+        with mock.patch.object(
+                CachedCountPagination, 'get_estimated_count',
+                return_value=2), mock.patch.object(
+                constants, 'COUNT_ESTIMATE_THRESHOLD', 1):
+            response = self.client.get('/api/recipes/?limit=2')
+            self.assertEqual(response.json()['count'], 5)
+            self.assertIsNotNone(response.json()['next'])
+            response = self.client.get('/api/recipes/?limit=2&page=3')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(len(response.json()['results']), 1)
+        self.assertIsNone(response.json()['next'])
+
+    def test_estimated_count_higher_than_real(self):
+        """Завышенная оценка не дает ссылок за последнюю страницу."""
+        self.create_recipes(3)
+        with mock.patch.object(
+                CachedCountPagination, 'get_estimated_count',
+                return_value=20), mock.patch.object(
+                constants, 'COUNT_ESTIMATE_THRESHOLD', 1):
+            response = self.client.get('/api/recipes/?limit=2')
+            self.assertTrue(response.json()['count_is_approximate'])
+            self.assertEqual(response.json()['count'], 20)
+            response = self.client.get('/api/recipes/?limit=2&page=2')
+            self.assertEqual(response.json()['count'], 3)
+            self.assertFalse(response.json()['count_is_approximate'])
+            self.assertIsNone(response.json()['next'])
+            response = self.client.get('/api/recipes/?limit=2&page=5')
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+
+    def test_filter_by_several_tags(self):
+        """Фильтр по нескольким тегам не дублирует рецепты."""
+        self.create_recipes(3)
+        lunch = Tag.objects.create(name='Обед', slug='lunch')
+        Tag.objects.create(name='Ужин', slug='dinner')
+        for recipe in Recipe.objects.all()[:2]:
+            recipe.tags.add(lunch)
+        response = self.client.get(
+            '/api/recipes/?tags=breakfast&tags=lunch&tags=dinner')
+        self.assertEqual(response.json()['count'], 3)
+        self.assertEqual(len(response.json()['results']), 3)
+        response = self.client.get('/api/recipes/?tags=lunch')
+        self.assertEqual(response.json()['count'], 2)
+
+    def test_filter_by_author(self):
+        """Фильтр по автору ищет точное совпадение id, можно несколько."""
+        self.create_recipes(2)
+        Recipe.objects.create(
+            name='Рецепт читателя',
+            text='Описание',
+            author=self.user,
+            cooking_time=10,
+            image='recipes/images/1_.jpg',
+        )
+        response = self.client.get(f'/api/recipes/?author={self.author.pk}')
+        self.assertEqual(response.json()['count'], 2)
+        response = self.client.get(f'/api/recipes/?author={self.user.pk}')
+        self.assertEqual(response.json()['count'], 1)
+        response = self.client.get(
+            f'/api/recipes/?author={self.user.pk},{self.author.pk}')
+        self.assertEqual(response.json()['count'], 3)
+
+    def test_search(self):
+        """Поиск по названию и описанию, совпадения в названии выше."""
+        self.create_recipes(2)
+        for name, text in (('Омлет', 'Яйца и суп'), ('Куриный суп', 'Вода')):
+            Recipe.objects.create(
+                name=name,
+                text=text,
+                author=self.author,
+                cooking_time=10,
+                image='recipes/images/1_.jpg',
+            )
+        # Целое слово в одном регистре находят и полнотекстовый поиск,
+        # и запасной icontains: LIKE в SQLite не сравнивает кириллицу
+        # без учета регистра
+        response = self.client.get('/api/recipes/?search=суп')
+        names = [recipe['name'] for recipe in response.json()['results']]
+        self.assertEqual(names, ['Куриный суп', 'Омлет'])
+        self.assertEqual(response.json()['count'], 2)
+
+    @skipUnless(
+        connection.vendor == 'postgresql', 'Полнотекстовый поиск PostgreSQL')
+    def test_full_text_search(self):
+        """Поиск по основам слов с синтаксисом websearch."""
+        for name, text in (('Суп', 'Вода и соль'), ('Омлет', 'Яйца и супы')):
+            Recipe.objects.create(
+                name=name,
+                text=text,
+                author=self.author,
+                cooking_time=10,
+                image='recipes/images/1_.jpg',
+            )
+
+        def get_names(search):
+            response = self.client.get('/api/recipes/', {'search': search})
+            return [recipe['name'] for recipe in response.json()['results']]
+
+        self.assertEqual(get_names('супы'), ['Суп', 'Омлет'])
+        self.assertEqual(get_names('суп -соль'), ['Омлет'])
+        self.assertEqual(get_names('уп'), [])
+
+    def test_filter_by_ingredients(self):
+        """Рецепты со всеми, с частью и без указанных ингредиентов."""
+        salt = Ingredient.objects.create(name='соль', measurement_unit='г')
+        egg = Ingredient.objects.create(name='яйцо', measurement_unit='шт')
+        self.create_recipes(3)
+        first, second, _ = Recipe.objects.all()
+        RecipeIngredient.objects.bulk_create([
+            RecipeIngredient(recipe=first, ingredient=salt, amount=1),
+            RecipeIngredient(recipe=first, ingredient=egg, amount=2),
+            RecipeIngredient(recipe=second, ingredient=salt, amount=1),
+        ])
+        ids = f'{self.ingredient.pk},{salt.pk},{egg.pk}'
+
+        def get_names(query):
+            response = self.client.get(f'/api/recipes/?{query}')
+            self.assertEqual(response.status_code, HTTPStatus.OK)
+            return [recipe['name'] for recipe in response.json()['results']]
+
+        self.assertEqual(get_names(f'ingredients={ids}'), ['Рецепт 0'])
+        self.assertEqual(
+            get_names(f'ingredients={ids}&ingredients_match=2'),
+            ['Рецепт 0', 'Рецепт 1'],
+        )
+        self.assertEqual(
+            get_names(f'ingredients={ids}&ingredients_match=1'),
+            ['Рецепт 0', 'Рецепт 1', 'Рецепт 2'],
+        )
+        self.assertEqual(
+            get_names(f'exclude_ingredients={salt.pk}'), ['Рецепт 2'])
+        # Явная сортировка важнее числа совпавших ингредиентов и ранга поиска
+        Favorite.objects.create(user=self.author, recipe=second)
+        self.assertEqual(
+            get_names(f'ingredients={ids}&ingredients_match=1'
+                      '&ordering=popular'),
+            ['Рецепт 1', 'Рецепт 0', 'Рецепт 2'],
+        )
+        self.assertEqual(
+            get_names('search=Рецепт&ordering=popular'),
+            ['Рецепт 1', 'Рецепт 0', 'Рецепт 2'],
+        )
+
+    def test_popular_and_trending_ordering(self):
+        """Сортировка по числу добавлений и по трендовому рейтингу."""
+        self.create_recipes(3)
+        first, _, last = Recipe.objects.all()
+        for user in (self.author, self.user):
+            Favorite.objects.get_or_create(user=user, recipe=last)
+        response = self.client.get('/api/recipes/?ordering=popular')
+        etag = response['ETag']
+        names = [recipe['name'] for recipe in response.json()['results']]
+        self.assertEqual(names, ['Рецепт 2', 'Рецепт 1', 'Рецепт 0'])
+        Favorite.objects.create(user=self.author, recipe=first)
+        Favorite.objects.create(user=self.author, recipe=Recipe.objects.get(
+            name='Рецепт 1'))
+        # Чужое избранное попадает в ETag не позже чем через интервал
+        with mock.patch.object(
+                time, 'time', return_value=time.time()
+                + constants.RECIPE_POPULARITY_ETAG_INTERVAL):
+            response = self.client.get(
+                '/api/recipes/?ordering=popular', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(
+            response.json()['results'][0]['name'], 'Рецепт 1')
+
+        self.assertEqual(RecipeScore.refresh(), 6)
+        self.assertEqual(RecipeScore.refresh(), 0)
+        # Более позднее добавление весит больше
+        Favorite.objects.filter(recipe=last).update(
+            created=F('created') - constants.TRENDING_HALF_LIFE * 4)
+        RecipeScore.objects.all().delete()
+        RecipeScoreState.objects.all().delete()
+        RecipeScore.refresh()
+        response = self.client.get('/api/recipes/?ordering=trending')
+        names = [recipe['name'] for recipe in response.json()['results']]
+        self.assertEqual(names, ['Рецепт 1', 'Рецепт 0', 'Рецепт 2'])
+
+    def test_trending_epoch_rebase(self):
+        """Старая эпоха сдвигается, веса не переполняют float."""
+        self.create_recipes(2)
+        first, last = Recipe.objects.all()
+        Favorite.objects.create(user=self.author, recipe=last)
+        RecipeScoreState.objects.create(
+            pk=1, epoch=timezone.now() - constants.TRENDING_HALF_LIFE * 2000)
+        RecipeScore.objects.create(recipe=first, trending_score=1e300)
+        self.assertEqual(RecipeScore.refresh(), 3)
+        state = RecipeScoreState.objects.get()
+        self.assertLess(
+            timezone.now() - state.epoch, constants.TRENDING_REBASE_INTERVAL)
+        scores = dict(RecipeScore.objects.values_list(
+            'recipe__name', 'trending_score'))
+        self.assertEqual(scores['Рецепт 0'], 0)
+        self.assertGreater(scores['Рецепт 1'], 0)
+        self.assertEqual(RecipeScore.get_weight(
+            timezone.now() + constants.TRENDING_HALF_LIFE * 5000, 1.0,
+            state.epoch,
+        ), 2.0 ** constants.TRENDING_MAX_EXPONENT)
+
+
+class SubscriptionsQueryCountTestCase(AuthenticatedAPITestCase):
+
+    def create_followed_authors(self, count, recipes_per_author=3):
+        for number in range(User.objects.count(),
+                            User.objects.count() + count):
+            author = create_user(f'author{number}')
+            Follow.objects.create(from_user=self.user, to_user=author)
+            for recipe_number in range(recipes_per_author):
+                Recipe.objects.create(
+                    name=f'Рецепт {number}-{recipe_number}',
+                    text='Описание',
+                    author=author,
+                    cooking_time=10,
+                    image='recipes/images/1_.jpg',
+                )
+
+    def get_subscriptions_queries(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(
+                '/api/users/subscriptions/?limit=100&recipes_limit=2')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        return response, context.captured_queries
+
+    def test_subscriptions_recipes_limit_and_count(self):
+        """Подписки ограничивают рецепты по recipes_limit и считают их."""
+        self.create_followed_authors(2)
+        response, _ = self.get_subscriptions_queries()
+        for author in response.json()['results']:
+            self.assertEqual(len(author['recipes']), 2)
+            self.assertEqual(author['recipes_count'], 3)
+            self.assertTrue(author['is_subscribed'])
+        # Отрицательный или нечисловой лимит не применяется
+        for recipes_limit in ('-1', 'abc'):
+            response = self.client.get(
+                '/api/users/subscriptions/',
+                {'recipes_limit': recipes_limit},
+            )
+            self.assertEqual(response.status_code, HTTPStatus.OK)
+            self.assertEqual(
+                len(response.json()['results'][0]['recipes']), 3)
+
+    def test_subscriptions_query_count_does_not_depend_on_authors(self):
+        """Число запросов к подпискам не зависит от числа авторов."""
+        self.create_followed_authors(2)
+        _, few_authors_queries = self.get_subscriptions_queries()
+        self.create_followed_authors(5)
+        _, many_authors_queries = self.get_subscriptions_queries()
+        self.assertEqual(
+            len(few_authors_queries), len(many_authors_queries))
+
+    def test_feed(self):
+        """Лента подписок отдает рецепты от новых к старым по курсору."""
+        self.create_followed_authors(3)
+        unfollowed = User.objects.exclude(pk=self.user.pk).first()
+        Follow.objects.filter(to_user=unfollowed).delete()
+        expected = list(
+            Recipe.objects.exclude(author=unfollowed).order_by(
+                '-pub_date', '-pk').values_list('name', flat=True)
+        )
+        url = '/api/recipes/feed/?limit=4'
+        names = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, HTTPStatus.OK)
+            results = response.json()['results']
+            self.assertTrue(all(
+                recipe['author']['is_subscribed'] for recipe in results))
+            names += [recipe['name'] for recipe in results]
+            url = response.json()['next']
+        self.assertEqual(names, expected)
+        response = self.client.get('/api/recipes/feed/?cursor=bad')
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+
+    @skipUnless(
+        connection.vendor == 'postgresql', 'LATERAL - только в PostgreSQL')
+    def test_lateral_feed_page(self):
+        """Запрос с LATERAL отдает те же страницы, что и запрос по ключу."""
+        self.create_followed_authors(3)
+        author_ids = list(
+            self.user.subscribed_to.values_list('to_user_id', flat=True))
+        before = None
+        while True:
+            page = feed.get_lateral_feed_page(
+                connection, author_ids, before, 4)
+            self.assertEqual(
+                page, feed.get_keyset_feed_page(author_ids, before, 4))
+            if len(page) < 4:
+                break
+            pk, pub_date = page[-1]
+            before = (pub_date, pk)
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+class ShoppingListTestCase(AuthenticatedAPITestCase):
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(TEST_MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.flour = Ingredient.objects.create(
+            name='мука', measurement_unit='г')
+        cls.milk = Ingredient.objects.create(
+            name='молоко', measurement_unit='мл')
+        cls.recipes = []
+        for number, milk_amount in enumerate((200, 300)):
+            recipe = Recipe.objects.create(
+                name=f'Блины {number}',
+                text='Описание',
+                author=cls.user,
+                cooking_time=10,
+                image='recipes/images/1_.jpg',
+            )
+            RecipeIngredient.objects.create(
+                recipe=recipe, ingredient=cls.flour, amount=100)
+            RecipeIngredient.objects.create(
+                recipe=recipe, ingredient=cls.milk, amount=milk_amount)
+            cls.recipes.append(recipe)
+
+    def get_shopping_list(self):
+        return dict(
+            ShoppingListItem.objects.filter(
+                owner=self.user,
+            ).values_list('ingredient__name', 'total_amount')
+        )
+
+    def test_shopping_list_follows_cart(self):
+        """Список покупок обновляется при добавлении и удалении рецептов."""
+        for recipe in self.recipes:
+            response = self.client.post(
+                f'/api/recipes/{recipe.pk}/shopping_cart/')
+            self.assertEqual(response.status_code, HTTPStatus.CREATED)
+        self.assertEqual(
+            self.get_shopping_list(), {'мука': 200, 'молоко': 500})
+        response = self.client.delete(
+            f'/api/recipes/{self.recipes[0].pk}/shopping_cart/')
+        self.assertEqual(response.status_code, HTTPStatus.NO_CONTENT)
+        self.assertEqual(
+            self.get_shopping_list(), {'мука': 100, 'молоко': 300})
+        self.client.delete(
+            f'/api/recipes/{self.recipes[1].pk}/shopping_cart/')
+        self.assertEqual(self.get_shopping_list(), {})
+
+    def test_shopping_list_rebuilt_on_recipe_update(self):
+        """Изменение ингредиентов рецепта пересчитывает список покупок."""
+        recipe = self.recipes[0]
+        self.client.post(f'/api/recipes/{recipe.pk}/shopping_cart/')
+        tag = Tag.objects.create(name='Обед', slug='lunch')
+        response = self.client.patch(
+            f'/api/recipes/{recipe.pk}/',
+            {
+                'ingredients': [{'id': self.flour.pk, 'amount': 50}],
+                'tags': [tag.pk],
+                'name': recipe.name,
+                'text': recipe.text,
+                'cooking_time': recipe.cooking_time,
+            },
+            format='json',
+        )
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(self.get_shopping_list(), {'мука': 50})
+
+    def test_shopping_list_follows_direct_writes(self):
+        """Правки в обход API и каскадные удаления тоже видны в списке."""
+        recipe, other = self.recipes
+        cart = Cart.objects.create(owner=self.user, recipe=recipe)
+        Cart.objects.create(owner=self.user, recipe=other)
+        self.assertEqual(
+            self.get_shopping_list(), {'мука': 200, 'молоко': 500})
+        recipe_ingredient = recipe.recipeingredient_set.get(
+            ingredient=self.milk)
+        recipe_ingredient.amount = 50
+        recipe_ingredient.save()
+        self.assertEqual(
+            self.get_shopping_list(), {'мука': 200, 'молоко': 350})
+        recipe_ingredient.delete()
+        self.assertEqual(
+            self.get_shopping_list(), {'мука': 200, 'молоко': 300})
+        sugar = Ingredient.objects.create(name='сахар', measurement_unit='г')
+        RecipeIngredient.objects.create(
+            recipe=recipe, ingredient=sugar, amount=30)
+        self.assertEqual(
+            self.get_shopping_list(),
+            {'мука': 200, 'молоко': 300, 'сахар': 30},
+        )
+        buyer = create_user('buyer')
+        cart.owner = buyer
+        cart.save()
+        self.assertEqual(
+            self.get_shopping_list(), {'мука': 100, 'молоко': 300})
+        self.assertEqual(
+            dict(buyer.shopping_list.values_list(
+                'ingredient__name', 'total_amount')),
+            {'мука': 100, 'сахар': 30},
+        )
+        recipe.delete()
+        self.assertFalse(buyer.shopping_list.exists())
+        self.assertEqual(
+            self.get_shopping_list(), {'мука': 100, 'молоко': 300})
+        other.author.delete()
+        self.assertFalse(ShoppingListItem.objects.exists())
+
+    def test_recipe_update_writes_only_changed_rows(self):
+        """Изменение одного ингредиента - одна строка UPDATE, без вставок."""
+        def count_writes(queries, table):
+            return {
+                statement: len([
+                    query for query in queries
+                    if query['sql'].startswith(statement)
+                    and f'"{table}"' in query['sql']
+                ])
+                for statement in ('INSERT', 'UPDATE', 'DELETE')
+            }
+
+        recipe = self.recipes[0]
+        tag = Tag.objects.create(name='Завтрак', slug='breakfast')
+        recipe.tags.set([tag])
+        ingredient_pks = set(
+            recipe.recipeingredient_set.values_list('pk', flat=True))
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.patch(
+                f'/api/recipes/{recipe.pk}/',
+                {
+                    'ingredients': [
+                        {'id': self.flour.pk, 'amount': 100},
+                        {'id': self.milk.pk, 'amount': 250},
+                    ],
+                    'tags': [tag.pk],
+                    'name': recipe.name,
+                    'text': recipe.text,
+                    'cooking_time': recipe.cooking_time,
+                },
+                format='json',
+            )
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        queries = context.captured_queries
+        self.assertEqual(
+            count_writes(queries, RecipeIngredient._meta.db_table),
+            {'INSERT': 0, 'UPDATE': 1, 'DELETE': 0},
+        )
+        self.assertEqual(
+            count_writes(queries, Recipe.tags.through._meta.db_table),
+            {'INSERT': 0, 'UPDATE': 0, 'DELETE': 0},
+        )
+        self.assertEqual(
+            set(recipe.recipeingredient_set.values_list('pk', flat=True)),
+            ingredient_pks,
+        )
+        self.assertEqual(
+            recipe.recipeingredient_set.get(ingredient=self.milk).amount, 250)
+
+    def test_counters(self):
+        """Счетчики корзины, избранного и рецептов следуют за данными."""
+        recipe = self.recipes[0]
+        self.client.post(f'/api/recipes/{recipe.pk}/shopping_cart/')
+        self.client.post(f'/api/recipes/{recipe.pk}/favorite/')
+        recipe.refresh_from_db()
+        self.assertEqual((recipe.cart_count, recipe.favorites_count), (1, 1))
+        self.client.delete(f'/api/recipes/{recipe.pk}/favorite/')
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.favorites_count, 0)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.recipes_count, 2)
+        User.objects.update(recipes_count=0)
+        Recipe.objects.update(cart_count=0)
+        call_command('reconcile_counters', stdout=io.StringIO())
+        self.user.refresh_from_db()
+        recipe.refresh_from_db()
+        self.assertEqual(self.user.recipes_count, 2)
+        self.assertEqual(recipe.cart_count, 1)
+
+    def test_download_shopping_cart(self):
+        """Список покупок скачивается потоковым PDF-файлом."""
+        self.client.post(f'/api/recipes/{self.recipes[0].pk}/shopping_cart/')
+        response = self.client.get('/api/recipes/download_shopping_cart/')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertTrue(response.streaming)
+        self.assertTrue(
+            b''.join(response.streaming_content).startswith(b'%PDF'))
+
+    def test_download_shopping_cart_text_formats(self):
+        """Список покупок отдается в txt и csv по ?format= и Accept."""
+        self.client.post(f'/api/recipes/{self.recipes[0].pk}/shopping_cart/')
+        response = self.client.get(
+            '/api/recipes/download_shopping_cart/?format=txt')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(
+            b''.join(response.streaming_content).decode(),
+            'молоко (мл) - 200\nмука (г) - 100\n',
+        )
+        response = self.client.get(
+            '/api/recipes/download_shopping_cart/',
+            HTTP_ACCEPT='text/csv',
+        )
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertTrue(response['Content-Type'].startswith('text/csv'))
+        self.assertEqual(
+            b''.join(response.streaming_content).decode().splitlines(),
+            ['Ингредиенты,Количество,Мера', 'молоко,200,мл', 'мука,100,г'],
+        )
+
+    def test_download_shopping_cart_negotiation(self):
+        """Без txt или csv в Accept отдается PDF, ошибки - в JSON."""
+        self.client.post(f'/api/recipes/{self.recipes[0].pk}/shopping_cart/')
+        response = self.client.get(
+            '/api/recipes/download_shopping_cart/',
+            HTTP_ACCEPT='application/json',
+        )
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        response = APIClient().get(
+            '/api/recipes/download_shopping_cart/?format=txt')
+        self.assertEqual(response.status_code, HTTPStatus.UNAUTHORIZED)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertIn('detail', response.json())
+
+    def test_shopping_cart_pdf_job(self):
+        """PDF списка покупок готовится в фоне и переиспользуется."""
+        jobs_url = '/api/recipes/download_shopping_cart/jobs/'
+        self.client.post(f'/api/recipes/{self.recipes[0].pk}/shopping_cart/')
+        # Чужая идущая задача и старый PDF того же пользователя
+        pdf_dir = shopping_list.get_pdf_dir(self.user)
+        os.makedirs(pdf_dir, exist_ok=True)
+        shopping_list.set_job_status(self.user, 'running', 'pending')
+        old_pdf_path = shopping_list.get_pdf_path(self.user, 'old')
+        open(old_pdf_path, 'w').close()
+        os.utime(old_pdf_path, (0, 0))
+        response = self.client.post(jobs_url)
+        self.assertEqual(response.status_code, HTTPStatus.ACCEPTED)
+        token = response.json()['id']
+        futures.wait(list(shopping_list.pending_jobs.values()))
+        response = self.client.get(f'{jobs_url}{token}/')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertTrue(
+            b''.join(response.streaming_content).startswith(b'%PDF'))
+        response = self.client.post(jobs_url)
+        self.assertEqual(
+            response.json(), {'id': token, 'status': 'ready'})
+        self.assertFalse(os.path.exists(old_pdf_path))
+        self.assertEqual(
+            shopping_list.get_pdf_status(self.user, 'running'), 'pending')
+
+    def test_shopping_cart_pdf_job_status(self):
+        """Неизвестный токен - 404, упавшая задача - статус failed."""
+        response = self.client.get(
+            '/api/recipes/download_shopping_cart/jobs/deadbeef/')
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+        # Готовый PDF того же списка мог остаться от другого теста
+        shutil.rmtree(shopping_list.get_pdf_dir(self.user), ignore_errors=True)
+        self.client.post(f'/api/recipes/{self.recipes[0].pk}/shopping_cart/')
+        with mock.patch.object(
+                shopping_list, 'build_pdf_document', side_effect=ValueError):
+            with self.assertLogs(shopping_list.logger):
+                response = self.client.post(
+                    '/api/recipes/download_shopping_cart/jobs/')
+                futures.wait(list(shopping_list.pending_jobs.values()))
+        token = response.json()['id']
+        response = self.client.get(
+            f'/api/recipes/download_shopping_cart/jobs/{token}/')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(
+            response.json(), {'id': token, 'status': 'failed'})
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+class RecipeWriteTestCase(AuthenticatedAPITestCase):
+    username = 'author'
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        Ingredient.objects.bulk_create([
+            Ingredient(name=f'ингредиент {number}', measurement_unit='г')
+            for number in range(30)
+        ])
+        Tag.objects.bulk_create([
+            Tag(name=f'Тег {number}', slug=f'tag{number}')
+            for number in range(5)
+        ])
+        cls.ingredients = list(Ingredient.objects.all())
+        cls.tags = list(Tag.objects.all())
+
+    def get_recipe_data(self, ingredient_ids, tag_ids):
+        return {
+            'ingredients': [
+                {'id': ingredient_id, 'amount': 10}
+                for ingredient_id in ingredient_ids
+            ],
+            'tags': tag_ids,
+            'image': TEST_IMAGE,
+            'name': 'Рецепт',
+            'text': 'Описание',
+            'cooking_time': 10,
+        }
+
+    def count_validation_queries(self, ingredient_count, tag_count):
+        data = self.get_recipe_data(
+            [ingredient.pk for ingredient in self.ingredients][
+                :ingredient_count],
+            [tag.pk for tag in self.tags][:tag_count],
+        )
+        data['name'] = f'Рецепт из {ingredient_count} ингредиентов'
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post('/api/recipes/', data, format='json')
+        self.assertEqual(response.status_code, HTTPStatus.CREATED)
+        return len([
+            query for query in context.captured_queries
+            if query['sql'].startswith('SELECT')
+            and ('"recipes_ingredient"' in query['sql']
+                 or '"recipes_tag"' in query['sql'])
+        ])
+
+    def test_ids_validated_in_bulk(self):
+        """Проверка id ингредиентов и тегов не зависит от их числа."""
+        self.assertEqual(
+            self.count_validation_queries(1, 1),
+            self.count_validation_queries(30, 5),
+        )
+
+    def test_missing_ids_reported_per_item(self):
+        """Несуществующие id отмечаются в ошибках каждого элемента."""
+        data = self.get_recipe_data(
+            [self.ingredients[0].pk, 0], [0, self.tags[0].pk])
+        response = self.client.post('/api/recipes/', data, format='json')
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+        self.assertEqual(
+            response.json()['ingredients'],
+            [{}, {'id': [constants.NON_EXISTENT_ELEMENTS]}],
+        )
+        self.assertEqual(
+            response.json()['tags'],
+            {'0': [constants.NON_EXISTENT_ELEMENTS]},
+        )
+
+    def test_tag_ids_must_be_integers(self):
+        """Логические и дробные значения не принимаются за id тега."""
+        tag_pk = self.tags[0].pk
+        for tag_id in (True, 1.7, float(tag_pk), 'abc'):
+            data = self.get_recipe_data([self.ingredients[0].pk], [tag_id])
+            response = self.client.post('/api/recipes/', data, format='json')
+            self.assertEqual(
+                response.status_code, HTTPStatus.BAD_REQUEST, tag_id)
+            self.assertIn('0', response.json()['tags'])
+        data = self.get_recipe_data([self.ingredients[0].pk], [str(tag_pk)])
+        response = self.client.post('/api/recipes/', data, format='json')
+        self.assertEqual(response.status_code, HTTPStatus.CREATED)
+
+    def test_image_size_checked_before_decoding(self):
+        """Слишком большое изображение отклоняется без декодирования."""
+        data = self.get_recipe_data(
+            [self.ingredients[0].pk], [self.tags[0].pk])
+        with mock.patch.object(constants, 'MAX_IMAGE_UPLOAD_SIZE', 10), \
+                mock.patch('api.serializers.base64.b64decode') as b64decode:
+            response = self.client.post('/api/recipes/', data, format='json')
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+        self.assertEqual(
+            response.json()['image'],
+            [constants.MESSAGE_ERROR_IMAGE_TOO_LARGE],
+        )
+        b64decode.assert_not_called()
+
+    def test_image_variants(self):
+        """После фоновой обработки рецепт отдает WebP-копии."""
+        image_file = io.BytesIO()
+        Image.new('RGB', (800, 600), 'red').save(image_file, 'PNG')
+        data = self.get_recipe_data(
+            [self.ingredients[0].pk], [self.tags[0].pk])
+        data['image'] = 'data:image/png;base64,' + base64.b64encode(
+            image_file.getvalue()).decode()
+        # Задача выполняется в потоке теста: соединение с базой общее
+        # с транзакцией теста и не закрывается после задачи
+        executor = SynchronousExecutor()
+        with mock.patch.object(images, 'executor', executor), \
+                mock.patch.object(images.connections, 'close_all'):
+            with self.captureOnCommitCallbacks(execute=True) as callbacks:
+                response = self.client.post(
+                    '/api/recipes/', data, format='json')
+            self.assertEqual(len(callbacks), 1)
+            self.assertEqual(len(executor.jobs), 1)
+            executor.run()
+        self.assertEqual(response.status_code, HTTPStatus.CREATED)
+        self.assertEqual(images.pending_jobs, {})
+        # Ответ на создание готов до фиксации, копий в нем еще нет
+        self.assertEqual(response.json()['image_thumb'],
+                         response.json()['image'])
+        self.assertEqual(response.json()['image_srcset'], '')
+
+        recipe = Recipe.objects.get(pk=response.json()['id'])
+        response = self.client.get(f'/api/recipes/{recipe.pk}/')
+        self.assertTrue(response.json()['image_thumb'].endswith('_320.webp'))
+        self.assertEqual(
+            [
+                source.rsplit(' ', 1)[1]
+                for source in response.json()['image_srcset'].split(', ')
+            ],
+            ['320w', '640w', '800w'],
+        )
+        storage = Recipe._meta.get_field('image').storage
+        with storage.open(Recipe.get_image_variant_name(
+                recipe.image.name, 640)) as variant_file:
+            variant = Image.open(variant_file)
+            self.assertEqual((variant.format, variant.size),
+                             ('WEBP', (640, 480)))
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+class RecipeImportExportTestCase(AuthenticatedAPITestCase):
+    username = 'author'
+    image_name = 'recipes/images/1_.jpg'
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(TEST_MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.tag = Tag.objects.create(name='Завтрак', slug='breakfast')
+        cls.flour = Ingredient.objects.create(
+            name='мука', measurement_unit='г')
+
+    def setUp(self):
+        super().setUp()
+        storage = Recipe._meta.get_field('image').storage
+        if not storage.exists(self.image_name):
+            storage.save(self.image_name, ContentFile(b''))
+
+    def get_line(self, name, **fields):
+        data = {
+            'name': name,
+            'text': 'Описание',
+            'cooking_time': 10,
+            'image': self.image_name,
+            'tags': [self.tag.pk],
+            'ingredients': [{'id': self.flour.pk, 'amount': 100}],
+        }
+        data.update(fields)
+        return json.dumps(data, ensure_ascii=False)
+
+    def test_import_reports_row_errors(self):
+        """Импорт сохраняет верные строки и сообщает об ошибках строк."""
+        lines = [
+            self.get_line('Блины'),
+            # Строка не в UTF-8 - такая же ошибка формата, как не JSON
+            'не json'.encode('cp1251'),
+            self.get_line('Оладьи', tags=[0]),
+            self.get_line('Блины'),
+            '',
+            self.get_line('Сырники', cooking_time=0),
+            self.get_line('Омлет'),
+        ]
+        response = self.client.post(
+            '/api/recipes/import/',
+            b'\n'.join(
+                line if isinstance(line, bytes) else line.encode()
+                for line in lines
+            ),
+            content_type='application/x-ndjson',
+        )
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        report = response.json()
+        self.assertEqual(report['created'], 2)
+        self.assertEqual(
+            [error['line'] for error in report['errors']], [2, 3, 4, 6])
+        self.assertEqual(
+            report['errors'][1]['errors'],
+            {'tags': [constants.NON_EXISTENT_ELEMENTS]},
+        )
+        recipe = Recipe.objects.get(name='Омлет')
+        self.assertEqual(recipe.author, self.user)
+        self.assertEqual(list(recipe.tags.all()), [self.tag])
+        self.assertEqual(
+            recipe.recipeingredient_set.get(ingredient=self.flour).amount,
+            100,
+        )
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.recipes_count, 2)
+
+    def test_import_checks_image_path(self):
+        """Импорт принимает только загруженные изображения рецептов."""
+        images = (
+            '../../etc/passwd',
+            'recipes/images/../../settings.py',
+            'users/avatar.jpg',
+            'recipes/images/missing.jpg',
+        )
+        report = RecipeImporter(author=self.user).run([
+            self.get_line(f'Рецепт {number}', image=image)
+            for number, image in enumerate(images)
+        ])
+        self.assertEqual(report['created'], 0)
+        self.assertEqual(
+            [error['errors'] for error in report['errors']],
+            [{'image': [constants.MESSAGE_ERROR_IMAGE_NOT_FOUND]}]
+            * len(images),
+        )
+
+    def test_process_images_skips_unsafe_path(self):
+        """Путь вне MEDIA_ROOT считается ошибкой, а не роняет команду."""
+        Recipe.objects.create(
+            name='Блины',
+            text='Описание',
+            cooking_time=10,
+            image='../outside.jpg',
+            author=self.user,
+        )
+        stderr = io.StringIO()
+        call_command(
+            'process_recipe_images', stdout=io.StringIO(), stderr=stderr)
+        self.assertIn('../outside.jpg', stderr.getvalue())
+
+    def test_failed_batch_frees_names(self):
+        """Названия из упавшего пакета можно импортировать снова."""
+        importer = RecipeImporter(author=self.user, batch_size=1)
+        create_recipes = importer.create_recipes
+        calls = []
+
+        def fail_first_batch(rows):
+            calls.append(rows)
+            if len(calls) == 1:
+                raise DatabaseError('сбой')
+            return create_recipes(rows)
+
+        with mock.patch.object(
+                importer, 'create_recipes', side_effect=fail_first_batch):
+            report = importer.run([self.get_line('Блины')] * 2)
+        self.assertEqual(report['created'], 1)
+        self.assertEqual(
+            [error['line'] for error in report['errors']], [1])
+        self.assertTrue(Recipe.objects.filter(name='Блины').exists())
+
+    def test_export_and_import_command(self):
+        """Выгрузка читается командой импорта без потерь."""
+        self.client.post(
+            '/api/recipes/import/',
+            '\n'.join(
+                self.get_line(f'Рецепт {number}') for number in range(3)
+            ).encode(),
+            content_type='application/x-ndjson',
+        )
+        response = self.client.get('/api/recipes/export/')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        exported = b''.join(response.streaming_content).decode()
+        self.assertEqual(len(exported.splitlines()), 3)
+        Recipe.objects.all().delete()
+        with tempfile.NamedTemporaryFile(
+            'w', suffix='.jsonl', encoding='utf-8'
+        ) as export_file:
+            export_file.write(exported)
+            export_file.flush()
+            call_command(
+                'import_recipes', export_file.name, '--batch-size=2',
+                stdout=io.StringIO(), stderr=io.StringIO(),
+            )
+        self.assertEqual(
+            sorted(Recipe.objects.values_list('name', flat=True)),
+            ['Рецепт 0', 'Рецепт 1', 'Рецепт 2'],
+        )
+        output = io.StringIO()
+        call_command('export_recipes', stdout=output)
+        self.assertEqual(output.getvalue(), exported)
+
+
+class IngredientSearchTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        Ingredient.objects.bulk_create(
+            [
+                Ingredient(name='сахар', measurement_unit='г'),
+                Ingredient(name='ванильный сахар', measurement_unit='г'),
+                Ingredient(name='сахарная пудра', measurement_unit='г'),
+                Ingredient(name='соль', measurement_unit='г'),
+            ]
+            + [
+                Ingredient(name=f'сахар {number}', measurement_unit='г')
+                for number in range(constants.INGREDIENT_SEARCH_LIMIT)
+            ]
+        )
+
+    def setUp(self):
+        # bulk_create не отправляет сигналы, сбрасываем кэш справочника
+        ingredient_cache.invalidate()
+
+    def test_prefix_matches_first(self):
+        """Совпадения с начала названия идут раньше вхождений в середине."""
+        response = self.client.get('/api/ingredients/?name=пудр')
+        self.assertEqual(
+            [ingredient['name'] for ingredient in response.json()],
+            ['сахарная пудра'],
+        )
+        response = self.client.get('/api/ingredients/?name=сах')
+        names = [ingredient['name'] for ingredient in response.json()]
+        self.assertEqual(len(names), constants.INGREDIENT_SEARCH_LIMIT)
+        self.assertNotIn('ванильный сахар', names)
+        response = self.client.get('/api/ingredients/?name=ильный')
+        self.assertEqual(
+            [ingredient['name'] for ingredient in response.json()],
+            ['ванильный сахар'],
+        )
+
+
+class CatalogueCacheTestCase(TestCase):
+
+    def setUp(self):
+        tag_cache.invalidate()
+        Tag.objects.create(name='Завтрак', slug='breakfast')
+
+    def test_tags_served_from_cache(self):
+        """Повторный запрос тегов не обращается к базе."""
+        self.client.get('/api/tags/')
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/tags/')
+        self.assertEqual(response.json()[0]['slug'], 'breakfast')
+        with self.assertNumQueries(0):
+            response = self.client.get(
+                '/api/tags/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+
+    def test_cache_invalidated_on_change(self):
+        """Изменение тега сбрасывает кэш справочника."""
+        self.client.get('/api/tags/')
+        tag = Tag.objects.create(name='Ужин', slug='dinner')
+        response = self.client.get(f'/api/tags/{tag.pk}/')
+        self.assertEqual(response.json()['slug'], 'dinner')
+        tag.delete()
+        response = self.client.get(f'/api/tags/{tag.pk}/')
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+
+    def test_load_ingredients(self):
+        """Загрузка справочника идемпотентна и сбрасывает его кэш."""
+        ingredient_cache.invalidate()
+        self.client.get('/api/ingredients/')
+        with tempfile.TemporaryDirectory() as data_dir:
+            csv_path = f'{data_dir}/ingredients.csv'
+            json_path = f'{data_dir}/ingredients.json'
+            with open(csv_path, 'w', encoding='utf-8') as csv_file:
+                csv_file.write('мука,г\nмолоко,мл\nяйцо,шт\n')
+            with open(json_path, 'w', encoding='utf-8') as json_file:
+                json.dump(
+                    [{'name': 'молоко', 'measurement_unit': 'л'}],
+                    json_file,
+                    ensure_ascii=False,
+                )
+            output = io.StringIO()
+            call_command('load_ingredients', csv_path, stdout=output)
+            self.assertIn('добавлено: 3, обновлено: 0', output.getvalue())
+            self.assertIn('мл: 1', output.getvalue())
+            response = self.client.get('/api/ingredients/')
+            self.assertEqual(len(response.json()), 3)
+            etag = response['ETag']
+            output = io.StringIO()
+            call_command('load_ingredients', csv_path, stdout=output)
+            self.assertIn('добавлено: 0, обновлено: 0', output.getvalue())
+            response = self.client.get(
+                '/api/ingredients/', HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+            call_command(
+                'load_ingredients', json_path, stdout=io.StringIO())
+        self.assertEqual(
+            Ingredient.objects.get(name='молоко').measurement_unit, 'л')
+        response = self.client.get('/api/ingredients/?name=молоко')
+        self.assertEqual(response.json()[0]['measurement_unit'], 'л')
+
+    def test_load_ingredients_counts_inserted_rows(self):
+        """Строки, пропущенные из-за конфликта, не считаются добавленными."""
+        # Параллельная загрузка добавила муку после проверки существующих
+        Ingredient.objects.create(name='мука', measurement_unit='г')
+        with tempfile.NamedTemporaryFile(
+            'w', suffix='.csv', encoding='utf-8'
+        ) as csv_file:
+            csv_file.write('мука,г\nмолоко,мл\n')
+            csv_file.flush()
+            output = io.StringIO()
+            with mock.patch.object(
+                    Ingredient.objects, 'filter',
+                    return_value=Ingredient.objects.none()):
+                call_command('load_ingredients', csv_file.name, stdout=output)
+        self.assertIn('добавлено: 1, обновлено: 0', output.getvalue())
+
+
+class BenchmarkCommandTestCase(TestCase):
+
+    def test_benchmark_rolls_back_data(self):
+        """Замеры проходят на малых данных, данные после них удаляются."""
+        output = io.StringIO()
+        call_command(
+            'benchmark',
+            '--authors=2',
+            '--recipes-per-author=3',
+            '--ingredients-per-recipe=2',
+            '--cart-size=2',
+            '--repeat=1',
+            stdout=output,
+        )
+        self.assertIn('медиана', output.getvalue())
+        self.assertFalse(Recipe.objects.exists())
+        self.assertFalse(Ingredient.objects.exists())
+
+    def test_benchmark_rejects_unknown_scenario(self):
+        with self.assertRaises(CommandError):
+            call_command('benchmark', 'unknown', stdout=io.StringIO())
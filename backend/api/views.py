@@ -1,41 +1,62 @@
+import csv
+import itertools
+import tempfile
+
 from django.contrib.auth import get_user_model
-from django.db.models import Sum
-from django.http import HttpResponse
+from django.db.models import (BooleanField, Exists, F, OuterRef, Prefetch,
+                              Subquery, Value)
+from django.http import (FileResponse, Http404, HttpResponse,
+                         StreamingHttpResponse)
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.conf import settings as djoser_settings
 from djoser.views import UserViewSet as DjoserUserViewSet
-from reportlab.lib import colors
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle
 from rest_framework import status
 from rest_framework.decorators import action
 from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 from rest_framework.serializers import ValidationError
 from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet
 
-from api.filters import IngredientFilter, RecipeFilter
-from api.pagination import PageNumberWithLimitPagination
+from api.bulk import RecipeImporter, export_recipes
+from api.catalogue import ingredient_cache, tag_cache
+from api.conditional import (AUTHORS_VERSION, CatalogueConditionalGetMixin,
+                             RecipeConditionalGetMixin, get_user_version)
+from api.feed import get_cached_followee_ids
+from api.filters import RecipeFilter
+from api.pagination import (FeedCursorPagination, PageNumberOrCursorPagination,
+                            UserPageNumberOrCursorPagination)
 from api.permissions import IsAuthenticatedAndAuthorOrReadOnly
+from api.renderers import (CSVShoppingListRenderer, PDFShoppingListRenderer,
+                           ShoppingListContentNegotiation,
+                           ShoppingListRenderer, TXTShoppingListRenderer)
 from api.serializers import (AddToFavoriteSerializer, AddToShoppingCart,
                              IngredientModelSerializer,
                              RecipeReadModelSerializer,
                              RecipeWriteModelSerializer, TagModelSerializer,
                              UserAuthorSubscribeSerializer,
-                             UserSubscriptionsModelSerializer)
+                             UserSubscriptionsModelSerializer,
+                             get_recipes_limit)
+from api.shopping_list import (STATUS_PENDING, STATUS_READY,
+                               build_pdf_document, get_pdf_path,
+                               get_pdf_status, render_pdf_async)
 from foodgram_backend import constants
-from recipes.models import Cart, Favorite, Ingredient, Recipe, Tag
+from recipes.models import (Cart, CatalogueVersion, Favorite, Ingredient,
+                            Recipe, ShoppingListItem, Tag)
 from users.models import Follow
 
-
 User = get_user_model()
 
 
+class Echo:
+    # Буфер для csv.writer, который сразу возвращает записанную строку
+    def write(self, value):
+        return value
+
+
 class UserViewSet(DjoserUserViewSet):
     permission_classes = (AllowAny,)
-    pagination_class = PageNumberWithLimitPagination
+    pagination_class = UserPageNumberOrCursorPagination
 
     def get_permissions(self):
         if self.action == 'me':
@@ -46,9 +67,32 @@ class UserViewSet(DjoserUserViewSet):
         queryset = super().get_queryset()
         if self.action == 'subscriptions':
             user = self.request.user
-            queryset = User.objects.filter(from_subscribed__from_user=user)
+            queryset = User.objects.filter(
+                from_subscribed__from_user=user
+            ).prefetch_related(
+                Prefetch('recipes', queryset=self.get_recipes_queryset()),
+            )
         return queryset
 
+    def get_count_cache_version(self, request):
+        return CatalogueVersion.get_versions([AUTHORS_VERSION]) + [
+            get_user_version(request.user.pk),
+        ]
+
+    def get_recipes_queryset(self):
+        queryset = Recipe.objects.all()
+        recipes_limit = get_recipes_limit(self.request)
+        if recipes_limit is None:
+            return queryset
+        # Первые recipes_limit рецептов каждого автора одним запросом
+        return queryset.filter(
+            pk__in=Subquery(
+                Recipe.objects.filter(
+                    author=OuterRef('author'),
+                ).values('pk')[:recipes_limit]
+            )
+        )
+
     def get_serializer_class(self):
         if self.action == 'list':
             return djoser_settings.SERIALIZERS.user
@@ -103,24 +147,55 @@ class UserViewSet(DjoserUserViewSet):
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class TagReadOnlyModelViewSet(ReadOnlyModelViewSet):
+class CatalogueCacheMixin:
+    # Список и отдельные записи справочника отдаются из кэша процесса
+    catalogue_cache = None
+
+    def get_catalogue_list(self, request):
+        return self.catalogue_cache.get_list()
+
+    def list(self, request, *args, **kwargs):
+        return Response(self.get_catalogue_list(request))
+
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            item = self.catalogue_cache.get_item(int(kwargs['pk']))
+        except ValueError:
+            item = None
+        if item is None:
+            raise Http404
+        return Response(item)
+
+
+class TagReadOnlyModelViewSet(CatalogueConditionalGetMixin,
+                              CatalogueCacheMixin,
+                              ReadOnlyModelViewSet):
     queryset = Tag.objects.all()
     serializer_class = TagModelSerializer
     pagination_class = None
+    catalogue_cache = tag_cache
 
 
-class IngredientReadOnlyModelViewSet(ReadOnlyModelViewSet):
+class IngredientReadOnlyModelViewSet(CatalogueConditionalGetMixin,
+                                     CatalogueCacheMixin,
+                                     ReadOnlyModelViewSet):
     queryset = Ingredient.objects.all()
     serializer_class = IngredientModelSerializer
     pagination_class = None
-    filter_backends = (DjangoFilterBackend,)
-    filterset_class = IngredientFilter
-    filterset_fields = ('name',)
+    catalogue_cache = ingredient_cache
 
+    def get_catalogue_list(self, request):
+        # Сначала совпадения с начала названия, затем вхождения в середине
+        name = request.query_params.get('name')
+        if not name:
+            return super().get_catalogue_list(request)
+        return self.catalogue_cache.search(
+            name, constants.INGREDIENT_SEARCH_LIMIT)
 
-class RecipeModelViewSet(ModelViewSet):
+
+class RecipeModelViewSet(RecipeConditionalGetMixin, ModelViewSet):
     permission_classes = (IsAuthenticatedAndAuthorOrReadOnly,)
-    pagination_class = PageNumberWithLimitPagination
+    pagination_class = PageNumberOrCursorPagination
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
     filterset_fields = (
@@ -128,12 +203,15 @@ class RecipeModelViewSet(ModelViewSet):
         'tags',
     )
 
+    # Поисковый вектор нужен только в WHERE, в ответ он не попадает
     queryset = Recipe.objects.select_related(
         'author',
     ).prefetch_related(
         'tags',
         'ingredients',
         'recipeingredient_set__ingredient',
+    ).defer(
+        'search_vector',
     )
     http_method_names = [
         'get',
@@ -142,8 +220,61 @@ class RecipeModelViewSet(ModelViewSet):
         'delete',
     ]
 
+    orderings = {
+        constants.RECIPE_ORDERING_POPULAR: (
+            F('favorites_count').desc(),
+            'id',
+        ),
+        constants.RECIPE_ORDERING_TRENDING: (
+            F('score__trending_score').desc(nulls_last=True),
+            F('favorites_count').desc(),
+            'id',
+        ),
+    }
+
+    def get_ordering_name(self):
+        ordering = self.request.query_params.get(
+            constants.RECIPE_ORDERING_PARAM)
+        if ordering in self.orderings:
+            return ordering
+        return None
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        user = self.request.user
+        if not user.is_authenticated:
+            return queryset.annotate(
+                is_favorited=Value(False, output_field=BooleanField()),
+                is_in_shopping_cart=Value(False, output_field=BooleanField()),
+            )
+        return queryset.annotate(
+            is_favorited=Exists(
+                Favorite.objects.filter(user=user, recipe=OuterRef('pk'))
+            ),
+            is_in_shopping_cart=Exists(
+                Cart.objects.filter(owner=user, recipe=OuterRef('pk'))
+            ),
+        )
+
+    def filter_queryset(self, queryset):
+        # Сортировка из ?ordering= применяется после фильтров и заменяет
+        # порядок по рангу поиска и числу совпавших ингредиентов
+        queryset = super().filter_queryset(queryset)
+        ordering = self.get_ordering_name()
+        if self.action == 'list' and ordering is not None:
+            queryset = queryset.order_by(*self.orderings[ordering])
+        return queryset
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        # Файловые рендереры не выводят ошибки: 401 и 400 отдаются в JSON
+        if getattr(response, 'exception', False) and issubclass(
+                self.renderer_classes[0], ShoppingListRenderer):
+            request.accepted_renderer = JSONRenderer()
+            request.accepted_media_type = JSONRenderer.media_type
+        return super().finalize_response(request, response, *args, **kwargs)
+
     def get_serializer_class(self):
-        if self.action in ('list', 'retrieve'):
+        if self.action in ('list', 'retrieve', 'feed'):
             return RecipeReadModelSerializer
         elif self.action in ('favorite', ):
             return AddToFavoriteSerializer
@@ -151,6 +282,50 @@ class RecipeModelViewSet(ModelViewSet):
             return AddToShoppingCart
         return RecipeWriteModelSerializer
 
+    def get_feed_author_ids(self):
+        return get_cached_followee_ids(self.request.user)
+
+    @action(
+        detail=False,
+        methods=['get', ],
+        url_path='feed',
+        permission_classes=[
+            IsAuthenticated,
+        ],
+        pagination_class=FeedCursorPagination,
+    )
+    def feed(self, request):
+        page = self.paginate_queryset(self.get_queryset())
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(
+        detail=False,
+        methods=['post', ],
+        url_path='import',
+        permission_classes=[
+            IsAuthenticated,
+        ],
+    )
+    def import_recipes(self, request):
+        # Тело в формате JSON lines читается построчно, не целиком
+        stream = request.stream
+        lines = iter(stream.readline, b'') if stream is not None else []
+        report = RecipeImporter(author=request.user).run(lines)
+        return Response(data=report, status=status.HTTP_200_OK)
+
+    @action(
+        detail=False,
+        methods=['get', ],
+        url_path='export',
+    )
+    def export_recipes(self, request):
+        queryset = self.filter_queryset(Recipe.objects.all())
+        return StreamingHttpResponse(
+            export_recipes(queryset),
+            content_type='application/x-ndjson; charset=utf-8',
+        )
+
     @action(
         detail=True,
         methods=[
@@ -197,7 +372,7 @@ class RecipeModelViewSet(ModelViewSet):
     def shopping_cart(self, request, pk):
         serializer = self.get_serializer(
             data={
-                'recipes': [pk, ],
+                'recipe': pk,
                 'owner': request.user.pk,
             }
         )
@@ -209,7 +384,7 @@ class RecipeModelViewSet(ModelViewSet):
     def delete_shopping_cart(self, request, pk=None):
         quantity_deleted, _ = Cart.objects.filter(
             owner=request.user,
-            recipes=self.get_object(),
+            recipe=self.get_object(),
         ).delete()
         if not quantity_deleted:
             raise ValidationError(
@@ -221,46 +396,61 @@ class RecipeModelViewSet(ModelViewSet):
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     def generate_pdf_document(self, ingredient_cart_lst, cart):
-        data_for_output = [
-            [
-                ingrdient['name'],
-                (f'{ingrdient["total_amount"]} '
-                 f'{ingrdient["measurement_unit"]}')
-            ]
-            for ingrdient in ingredient_cart_lst
-        ]
+        # Документ пишется во временный файл, который уходит на диск,
+        # если список покупок слишком большой для памяти воркера
+        pdf_file = tempfile.SpooledTemporaryFile(
+            max_size=constants.PDF_SPOOL_MAX_SIZE)
+        build_pdf_document(ingredient_cart_lst, pdf_file)
+        pdf_file.seek(0)
+        response = FileResponse(
+            pdf_file,
+            as_attachment=True,
+            filename=f'Заказ-{cart.pk}.pdf',
+            content_type='application/pdf',
+        )
+        return response
 
-        data_for_output.insert(0, ['Ингредиенты', 'Количество', ])
+    def get_shopping_list_queryset(self, user):
+        return ShoppingListItem.objects.filter(
+            owner=user,
+        ).values(
+            'total_amount',
+            name=F('ingredient__name'),
+            measurement_unit=F('ingredient__measurement_unit'),
+        )
 
-        response = HttpResponse(content_type='application/pdf')
-        filename = f'attachment; filename="Заказ-{cart.pk}.pdf"'
-        response['Content-Disposition'] = filename
-        doc = SimpleDocTemplate(response, pagesize=letter)
+    def get_shopping_list_filename(self, cart, extension):
+        return f'attachment; filename="Заказ-{cart.pk}.{extension}"'
 
-        # Регистрируем шрифт
-        pdfmetrics.registerFont(
-            TTFont(constants.FONT_NAME, constants.FONT_PATH))
+    def generate_txt_document(self, ingredients, cart):
+        lines = (
+            (f'{ingredient["name"]} ({ingredient["measurement_unit"]}) '
+             f'- {ingredient["total_amount"]}\n')
+            for ingredient in ingredients.iterator()
+        )
+        response = StreamingHttpResponse(
+            lines, content_type='text/plain; charset=utf-8')
+        response['Content-Disposition'] = self.get_shopping_list_filename(
+            cart, 'txt')
+        return response
 
-        # Создаем таблицу и задаем стиль
-        table = Table(
-            data_for_output,
-            colWidths=constants.COLWIDTHS_VALUE,
-            rowHeights=constants.ROWHEIGHTS_VALUE,
+    def generate_csv_document(self, ingredients, cart):
+        writer = csv.writer(Echo())
+        rows = itertools.chain(
+            [writer.writerow(['Ингредиенты', 'Количество', 'Мера'])],
+            (
+                writer.writerow([
+                    ingredient['name'],
+                    ingredient['total_amount'],
+                    ingredient['measurement_unit'],
+                ])
+                for ingredient in ingredients.iterator()
+            ),
         )
-        style = TableStyle([('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-                            ('TEXTCOLOR', (0, 0), (-1, 0), colors.black),
-                            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                            ('FONTNAME', (0, 0), (-1, -1),
-                             constants.FONT_NAME),
-                            ('FONTSIZE', (0, 0), (-1, -1), 12),
-                            ('BOTTOMPADDING', (0, 0), (-1, 0), 5),
-                            ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-                            ('GRID', (0, 0), (-1, -1), 1, colors.black)])
-        table.setStyle(style)
-
-        # Добавляем таблицу в документ
-        elements = [table]
-        doc.build(elements)
+        response = StreamingHttpResponse(
+            rows, content_type='text/csv; charset=utf-8')
+        response['Content-Disposition'] = self.get_shopping_list_filename(
+            cart, 'csv')
         return response
 
     @action(
@@ -270,21 +460,77 @@ class RecipeModelViewSet(ModelViewSet):
         permission_classes=[
             IsAuthenticated,
         ],
+        renderer_classes=[
+            PDFShoppingListRenderer,
+            TXTShoppingListRenderer,
+            CSVShoppingListRenderer,
+        ],
+        content_negotiation_class=ShoppingListContentNegotiation,
     )
     def download_shopping_cart(self, request):
         user = request.user
         cart = Cart.objects.filter(owner=user).first()
         if not cart:
             return HttpResponse(status=200)
-        ingredient_cart_lst = list(Ingredient.objects.filter(
-            recipes__carts__owner=user
-        ).values(
-            'name', 'measurement_unit'
-        ).annotate(
-            total_amount=Sum('recipeingredient__amount')
-        ))
+        ingredients = self.get_shopping_list_queryset(user)
+        # Формат выбирается по ?format=txt|csv|pdf или заголовку Accept
+        document_format = request.accepted_renderer.format
+        if document_format == TXTShoppingListRenderer.format:
+            return self.generate_txt_document(ingredients, cart)
+        if document_format == CSVShoppingListRenderer.format:
+            return self.generate_csv_document(ingredients, cart)
         response = self.generate_pdf_document(
-            ingredient_cart_lst,
+            list(ingredients),
             cart,
         )
         return response
+
+    @action(
+        detail=False,
+        methods=['post', ],
+        url_path='download_shopping_cart/jobs',
+        permission_classes=[
+            IsAuthenticated,
+        ],
+    )
+    def create_shopping_cart_job(self, request):
+        user = request.user
+        if not Cart.objects.filter(owner=user).exists():
+            return Response(status=status.HTTP_200_OK)
+        token, job_status = render_pdf_async(
+            user, list(self.get_shopping_list_queryset(user)))
+        return Response(
+            data={'id': token, 'status': job_status},
+            status=status.HTTP_202_ACCEPTED,
+        )
+
+    @action(
+        detail=False,
+        methods=['get', ],
+        url_path=r'download_shopping_cart/jobs/(?P<token>[0-9a-f]+)',
+        permission_classes=[
+            IsAuthenticated,
+        ],
+    )
+    def shopping_cart_job(self, request, token):
+        job_status = get_pdf_status(request.user, token)
+        if job_status is None:
+            raise Http404
+        if job_status != STATUS_READY:
+            return Response(
+                data={'id': token, 'status': job_status},
+                status=(
+                    status.HTTP_202_ACCEPTED
+                    if job_status == STATUS_PENDING else status.HTTP_200_OK
+                ),
+            )
+        try:
+            pdf_file = open(get_pdf_path(request.user, token), 'rb')
+        except FileNotFoundError:
+            raise Http404
+        return FileResponse(
+            pdf_file,
+            as_attachment=True,
+            filename=f'Заказ-{token[:8]}.pdf',
+            content_type='application/pdf',
+        )
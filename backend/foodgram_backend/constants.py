@@ -1,18 +1,69 @@
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
 REPEATED_INGREDIENTS = 'Повторяющиеся ингредиенты'
 REPEATED_TAGS = 'Повторяющиеся теги'
 INGREDIENTS_REQUIRED_FIELD = 'Ингредиенты являются обязательным полем'
 TAGS_REQUIRED_FIELD = 'Теги являются обязательным полем'
 NON_EXISTENT_ELEMENTS = 'Несуществующие элементы'
 FONT_NAME = 'JetBrainsMono-Regular'
-FONT_PATH = '/app/fonts/JetBrainsMono-Regular.ttf'  # рабочая директория
-# FONT_PATH = '/home/kirill/Документы/job/projects/training_proj/yandex-practicum/projects/final_proj/foodgram-project-react/backend/fonts/JetBrainsMono-Regular.ttf'
+# В контейнере это /app/fonts/JetBrainsMono-Regular.ttf
+FONT_PATH = str(
+    Path(__file__).resolve().parent.parent / 'fonts' / f'{FONT_NAME}.ttf'
+)
+# Справочник ингредиентов лежит в data/ в корне репозитория
+INGREDIENTS_DATA_PATH = str(
+    Path(__file__).resolve().parent.parent.parent / 'data' / 'ingredients.csv'
+)
+INGREDIENT_LOAD_BATCH_SIZE = 1000
 MAX_LENGTH_NAME = 200
 MAX_LENGTH_USER_NAME = 150
 MIN_VALUE_FOR_VALIDATOR = 1
 MAX_VALUE_FOR_VALIDATOR = 32000
 ZERO_INDEX = 0
+INGREDIENT_SEARCH_LIMIT = 50
+# Как часто (в секундах) кэш справочников сверяет версию с базой
+CATALOGUE_CACHE_CHECK_INTERVAL = 5
+# Кэш общего числа записей в пагинации (секунды) и порог оценки планировщика
+COUNT_CACHE_TIMEOUT = 30
+COUNT_ESTIMATE_THRESHOLD = 10000
+# Трендовый рейтинг: вклад добавления вдвое меньше через TRENDING_HALF_LIFE.
+# Веса растут от эпохи вдвое за TRENDING_HALF_LIFE, поэтому эпоха
+# сдвигается не реже TRENDING_REBASE_INTERVAL, а показатель степени
+# ограничен TRENDING_MAX_EXPONENT: float переполняется на 2 ** 1024
+TRENDING_EPOCH = datetime(2024, 1, 1, tzinfo=timezone.utc)
+TRENDING_HALF_LIFE = timedelta(days=7)
+TRENDING_REBASE_INTERVAL = TRENDING_HALF_LIFE * 52
+TRENDING_MAX_EXPONENT = 512
+TRENDING_FAVORITE_WEIGHT = 1.0
+TRENDING_CART_WEIGHT = 0.5
+RECIPE_ORDERING_PARAM = 'ordering'
+RECIPE_ORDERING_POPULAR = 'popular'
+RECIPE_ORDERING_TRENDING = 'trending'
+# Как долго (в секундах) ETag популярных рецептов не учитывает чужое избранное
+RECIPE_POPULARITY_ETAG_INTERVAL = 60
+FEED_FOLLOWEES_CACHE_TIMEOUT = 60
+SEARCH_CONFIG = 'russian'
+MAX_LENGTH_IMAGE = 100
+# Импорт и экспорт рецептов идут пакетами, каждый пакет - транзакция
+RECIPE_IMPORT_BATCH_SIZE = 1000
+RECIPE_EXPORT_BATCH_SIZE = 1000
+# Предел размера изображения рецепта проверяется до декодирования base64
+MAX_IMAGE_UPLOAD_SIZE = 2 * 1024 * 1024
+# Ширины уменьшенных WebP-копий изображения рецепта, первая - превью
+RECIPE_IMAGE_WIDTHS = (320, 640, 1280)
+RECIPE_IMAGE_WEBP_QUALITY = 80
+RECIPE_IMAGE_VARIANTS_DIR = 'variants'
+RECIPE_IMAGE_WORKERS = 2
 COLWIDTHS_VALUE = 250
 ROWHEIGHTS_VALUE = 30
+# PDF крупнее этого размера (в байтах) пишется во временный файл на диске
+PDF_SPOOL_MAX_SIZE = 1024 * 1024
+# Фоновая генерация PDF: каталог в MEDIA_ROOT и число потоков на воркер
+SHOPPING_LIST_PDF_DIR = 'shopping_lists'
+SHOPPING_LIST_PDF_WORKERS = 2
+# Задача без результата дольше этого срока (в секундах) считается упавшей
+SHOPPING_LIST_PDF_JOB_TIMEOUT = 10 * 60
 MIN_MESSAGE_VALIDATOR = f'Минимальное значение: {MIN_VALUE_FOR_VALIDATOR}'
 MAX_MESSAGE_VALIDATOR = f'Максимальное значение: {MAX_VALUE_FOR_VALIDATOR}'
 MESSAGE_ERROR_SUBSCRIBE_TWICE = (
@@ -32,3 +83,13 @@ MESSAGE_ERROR_RECIPE_ALREADY_IN_CART = (
 MESSAGE_ERROR_DONT_SUBSCRIBE_USER = 'вы не подписаны на этого пользователя'
 MESSAGE_ERROR_RECIPE_NOT_IN_FAVORITE = 'Рецепт не был добавлен в избранное'
 MESSAGE_ERROR_RECIPE_NOT_IN_CART = 'Рецепт не был добавлен в корзину'
+MESSAGE_ERROR_RECIPE_NAME_EXISTS = 'Рецепт с таким названием уже существует'
+MESSAGE_ERROR_INVALID_JSON = 'Строка не является JSON-объектом'
+MESSAGE_ERROR_AUTHOR_REQUIRED = 'Не указан автор рецепта'
+MESSAGE_ERROR_IMPORT_BATCH_FAILED = 'Пакет строк не сохранен: {error}'
+MESSAGE_ERROR_IMAGE_NOT_FOUND = (
+    'Изображение не найдено в каталоге изображений рецептов'
+)
+MESSAGE_ERROR_IMAGE_TOO_LARGE = (
+    f'Размер изображения больше {MAX_IMAGE_UPLOAD_SIZE // (1024 * 1024)} МБ'
+)
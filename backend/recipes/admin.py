@@ -10,15 +10,15 @@ class RecipeIngredientInline(admin.TabularInline):
 
 
 class RecipeAdmin(admin.ModelAdmin):
-    list_display = ('name', 'author',)
+    list_display = ('name', 'author', 'favorites_count', 'cart_count',)
     list_filter = ('name', 'author',)
 
     inlines = [RecipeIngredientInline, ]
 
-    readonly_fields = ('in_favorites_count', )
+    readonly_fields = ('in_favorites_count', 'cart_count', )
 
     def in_favorites_count(self, obj):
-        return obj.in_favorites.count()
+        return obj.favorites_count
 
     in_favorites_count.short_description = 'Count in favorite'
 
@@ -0,0 +1,37 @@
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def change_counter(queryset, field, delta):
+    # Счетчик не уходит ниже нуля, даже если успел разойтись с данными
+    if delta < 0:
+        queryset = queryset.filter(**{f'{field}__gte': -delta})
+    queryset.update(**{field: F(field) + delta})
+
+
+def count_related(queryset, field):
+    return Coalesce(
+        Subquery(
+            queryset.filter(
+                **{field: OuterRef('pk')}
+            ).order_by().values(
+                field,
+            ).annotate(
+                total=Count('pk'),
+            ).values('total')
+        ),
+        0,
+    )
+
+
+def reconcile_counters(Recipe, User, Favorite, Cart, Follow):
+    """Пересчитывает денормализованные счетчики по исходным таблицам."""
+    recipes = Recipe.objects.update(
+        favorites_count=count_related(Favorite.objects.all(), 'recipe'),
+        cart_count=count_related(Cart.objects.all(), 'recipe'),
+    )
+    users = User.objects.update(
+        recipes_count=count_related(Recipe.objects.all(), 'author'),
+        followers_count=count_related(Follow.objects.all(), 'to_user'),
+    )
+    return recipes, users
@@ -0,0 +1,404 @@
+import math
+import random
+import statistics
+import time
+from io import BytesIO, StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Q
+from django.http import QueryDict
+from django.test.utils import CaptureQueriesContext
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from rest_framework.test import APIClient
+
+from api.feed import get_keyset_feed_page, get_lateral_feed_page
+from api.filters import RecipeFilter
+from api.pagination import FeedCursorPagination
+from api.shopping_list import build_pdf_document
+from foodgram_backend import constants
+from recipes.models import (Cart, Ingredient, Recipe, RecipeIngredient,
+                            ShoppingListItem, Tag)
+from users.models import Follow
+
+User = get_user_model()
+
+SCENARIOS = (
+    'pdf',
+    'ingredients',
+    'tags',
+    'feed',
+    'search',
+    'recipe_ingredients',
+)
+# Ввод в автодополнение ингредиентов по одной букве
+INGREDIENT_SEARCH_INPUTS = (
+    'с', 'са', 'сах', 'саха', 'сахар',
+    'м', 'мо', 'мол', 'моло', 'молок',
+    'к', 'ка', 'кар', 'карт', 'карто',
+)
+RECIPE_WORDS = (
+    'суп', 'борщ', 'салат', 'пирог', 'каша', 'блины', 'омлет', 'соус',
+    'рагу', 'запеканка', 'котлеты', 'плов', 'пюре', 'окрошка', 'сырники',
+    'жаркое', 'гуляш', 'пельмени', 'вареники', 'лазанья',
+)
+TEXT_WORDS = (
+    'нарезать', 'обжарить', 'тушить', 'запекать', 'посолить', 'поперчить',
+    'перемешать', 'остудить', 'подавать', 'горячим', 'холодным', 'минут',
+    'духовке', 'сковороде', 'кастрюле', 'мелко', 'крупно', 'добавить',
+)
+# Слово из названий рецептов для полнотекстового поиска
+RECIPE_SEARCH_VALUE = 'пирог'
+BATCH_SIZE = 5000
+RECIPE_PAGE_SIZE = 6
+# Глубина листания ленты для замера дальней страницы
+FEED_DEEP_OFFSET = 600
+
+
+class Command(BaseCommand):
+    help = (
+        'Замеряет время ответа API на синтетических данных: медиану, '
+        'p95 и число SQL-запросов. Данные создаются в транзакции и '
+        'откатываются после замеров. Запускать на тестовой базе.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'scenarios',
+            nargs='*',
+            help=f'Сценарии: {", ".join(SCENARIOS)}. По умолчанию - все',
+        )
+        parser.add_argument('--authors', type=int, default=1000)
+        parser.add_argument('--recipes-per-author', type=int, default=100)
+        parser.add_argument('--ingredients-per-recipe', type=int, default=10)
+        parser.add_argument('--cart-size', type=int, default=50)
+        parser.add_argument('--follows', type=int, default=1000)
+        parser.add_argument('--repeat', type=int, default=50)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        scenarios = options['scenarios'] or SCENARIOS
+        unknown = set(scenarios) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(
+                f'Неизвестные сценарии: {", ".join(sorted(unknown))}')
+        self.repeat = options['repeat']
+        self.random = random.Random(options['seed'])
+        with transaction.atomic():
+            started = time.perf_counter()
+            self.create_data(options)
+            self.stdout.write(
+                f'Данные созданы за {time.perf_counter() - started:.1f} с: '
+                f'рецептов - {Recipe.objects.count()}, '
+                f'ингредиентов в рецептах - '
+                f'{RecipeIngredient.objects.count()}'
+            )
+            self.client = APIClient()
+            self.client.force_authenticate(self.reader)
+            for scenario in scenarios:
+                self.stdout.write(self.style.MIGRATE_HEADING(scenario))
+                getattr(self, f'benchmark_{scenario}')()
+            transaction.set_rollback(True)
+
+    def create_data(self, options):
+        call_command('load_ingredients', stdout=StringIO())
+        self.ingredient_ids = list(
+            Ingredient.objects.values_list('pk', flat=True))
+        # Первичные ключи после bulk_create возвращает не каждая база,
+        # поэтому созданные записи перечитываются
+        Tag.objects.bulk_create([
+            Tag(name=f'Тег {number}', slug=f'benchmark-{number}',
+                color=f'#{number:06x}')
+            for number in range(10)
+        ])
+        self.tags = list(Tag.objects.filter(slug__startswith='benchmark-'))
+        self.reader = User.objects.create(
+            username='benchmark-reader',
+            email='benchmark-reader@example.com',
+            first_name='Читатель',
+            last_name='Замеров',
+            password='!',
+        )
+        User.objects.bulk_create([
+            User(
+                username=f'benchmark-author-{number}',
+                email=f'benchmark-author-{number}@example.com',
+                first_name='Автор',
+                last_name=str(number),
+                password='!',
+            )
+            for number in range(options['authors'])
+        ])
+        authors = list(User.objects.filter(
+            username__startswith='benchmark-author-'))
+        self.authors = authors
+        recipes_count = len(authors) * options['recipes_per_author']
+        # Рецепты авторов перемешаны по времени публикации, как в жизни
+        recipes = [
+            Recipe(
+                author=self.random.choice(authors),
+                name=f'{self.random.choice(RECIPE_WORDS)} №{number}',
+                text=' '.join(self.random.choices(TEXT_WORDS, k=30)),
+                cooking_time=self.random.randint(5, 120),
+                image='recipes/images/benchmark.jpg',
+            )
+            for number in range(recipes_count)
+        ]
+        Recipe.objects.bulk_create(recipes, batch_size=BATCH_SIZE)
+        self.recipe_ids = list(Recipe.objects.filter(
+            author__in=authors).values_list('pk', flat=True))
+        RecipeIngredient.objects.bulk_create(
+            (
+                RecipeIngredient(
+                    recipe_id=recipe_id,
+                    ingredient_id=ingredient_id,
+                    amount=self.random.randint(1, 500),
+                )
+                for recipe_id in self.recipe_ids
+                for ingredient_id in self.random.sample(
+                    self.ingredient_ids, options['ingredients_per_recipe'])
+            ),
+            batch_size=BATCH_SIZE,
+        )
+        Recipe.tags.through.objects.bulk_create(
+            (
+                Recipe.tags.through(recipe_id=recipe_id, tag_id=tag.pk)
+                for recipe_id in self.recipe_ids
+                for tag in self.random.sample(self.tags, 2)
+            ),
+            batch_size=BATCH_SIZE,
+        )
+        Cart.objects.bulk_create([
+            Cart(owner=self.reader, recipe_id=recipe_id)
+            for recipe_id in self.random.sample(
+                self.recipe_ids, options['cart_size'])
+        ])
+        ShoppingListItem.rebuild([self.reader.pk])
+        Follow.objects.bulk_create([
+            Follow(from_user=self.reader, to_user=author)
+            for author in self.random.sample(
+                authors, min(options['follows'], len(authors)))
+        ])
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+
+    def measure(self, label, *funcs):
+        """Медиана и p95 времени вызова funcs в мс после прогрева.
+
+        Каждая функция - отдельный запрос, например одно нажатие клавиши
+        в автодополнении, время замеряется для каждой по отдельности.
+        """
+        for func in funcs:
+            func()
+        timings = []
+        queries_count = 0
+        for _ in range(self.repeat):
+            for func in funcs:
+                with CaptureQueriesContext(connection) as queries:
+                    started = time.perf_counter()
+                    func()
+                    timings.append((time.perf_counter() - started) * 1000)
+                queries_count = max(
+                    queries_count, len(queries.captured_queries))
+        timings.sort()
+        p95 = timings[math.ceil(len(timings) * 0.95) - 1]
+        self.stdout.write(
+            f'  {label}: медиана {statistics.median(timings):.2f} мс, '
+            f'p95 {p95:.2f} мс, запросов {queries_count}'
+        )
+
+    def get(self, path, **params):
+        response = self.client.get(path, params)
+        if response.status_code != 200:
+            raise CommandError(f'{path}: ответ {response.status_code}')
+        # Потоковый ответ тоже читается целиком, как его прочтет клиент
+        return response.getvalue()
+
+    def filter_recipes(self, query):
+        return RecipeFilter(
+            QueryDict(query), queryset=Recipe.objects.all()).qs
+
+    def get_page(self, queryset, offset=0):
+        # Страница списка по OFFSET: число записей и сами записи
+        return lambda: (
+            queryset.count(),
+            list(queryset[offset:offset + RECIPE_PAGE_SIZE]),
+        )
+
+    def benchmark_pdf(self):
+        ingredients = list(
+            ShoppingListItem.objects.filter(owner=self.reader).values(
+                'total_amount',
+                'ingredient__name',
+                'ingredient__measurement_unit',
+            )
+        )
+        ingredients = [
+            {
+                'name': item['ingredient__name'],
+                'measurement_unit': item['ingredient__measurement_unit'],
+                'total_amount': item['total_amount'],
+            }
+            for item in ingredients
+        ]
+        self.stdout.write(f'  строк в списке покупок: {len(ingredients)}')
+
+        def build_with_font_registration():
+            # Как было: шрифт разбирался заново на каждый запрос,
+            # документ собирался в памяти
+            pdfmetrics.registerFont(
+                TTFont(constants.FONT_NAME, constants.FONT_PATH))
+            build_pdf_document(ingredients, BytesIO())
+
+        self.measure(
+            'было, шрифт на каждый запрос', build_with_font_registration)
+        self.measure(
+            'разбор шрифта TTFont',
+            lambda: TTFont(constants.FONT_NAME, constants.FONT_PATH),
+        )
+        self.measure(
+            'стало, документ без регистрации шрифта',
+            lambda: build_pdf_document(ingredients, BytesIO()),
+        )
+        self.measure(
+            'стало, GET download_shopping_cart/?format=pdf',
+            lambda: self.get(
+                '/api/recipes/download_shopping_cart/', format='pdf'),
+        )
+
+    def benchmark_ingredients(self):
+        def search_icontains(value):
+            # Как было: ILIKE '%x%' по всему справочнику без ограничения
+            return lambda: list(
+                Ingredient.objects.filter(name__icontains=value).values())
+
+        def search_api(value):
+            return lambda: self.get('/api/ingredients/', name=value)
+
+        self.measure(
+            'было, icontains без ограничения',
+            *map(search_icontains, INGREDIENT_SEARCH_INPUTS),
+        )
+        self.measure(
+            'стало, GET /api/ingredients/?name=',
+            *map(search_api, INGREDIENT_SEARCH_INPUTS),
+        )
+
+    def benchmark_tags(self):
+        slugs = [tag.slug for tag in self.tags[:2]]
+        query = '&'.join(f'tags={slug}' for slug in slugs)
+        self.stdout.write(f'  ?{query}')
+        self.measure(
+            'было, JOIN тегов и DISTINCT',
+            self.get_page(
+                Recipe.objects.filter(tags__slug__in=slugs).distinct()),
+        )
+        self.measure(
+            'стало, EXISTS по промежуточной таблице',
+            self.get_page(self.filter_recipes(query)),
+        )
+        self.measure(
+            'стало, GET /api/recipes/',
+            lambda: self.get(f'/api/recipes/?{query}&exact_count=true'),
+        )
+
+    def benchmark_feed(self):
+        author_ids = list(Follow.objects.filter(
+            from_user=self.reader).values_list('to_user_id', flat=True))
+        self.stdout.write(f'  подписок: {len(author_ids)}')
+        limit = RECIPE_PAGE_SIZE + 1
+        # Как было бы без ленты: author__in по подпискам и OFFSET
+        feed = Recipe.objects.filter(
+            author__in=Follow.objects.filter(
+                from_user=self.reader).values('to_user_id'),
+        ).order_by('-pub_date', '-id')
+        rows = get_keyset_feed_page(author_ids, None, FEED_DEEP_OFFSET)
+        if not rows:
+            return
+        pk, pub_date = rows[-1]
+        before = (pub_date, pk)
+        cursor = FeedCursorPagination().encode_cursor([pub_date, pk])
+        for label, offset, page_before, params in (
+            ('первая страница', 0, None, {}),
+            (f'страница после {len(rows)} рецептов', len(rows), before,
+             {'cursor': cursor}),
+        ):
+            self.stdout.write(f'  {label}')
+            self.measure(
+                'было, author__in и OFFSET',
+                self.get_page(feed, offset),
+            )
+            if connection.vendor == 'postgresql':
+                self.measure(
+                    'стало, LATERAL по авторам',
+                    lambda: get_lateral_feed_page(
+                        connection, author_ids, page_before, limit),
+                )
+            self.measure(
+                'стало, keyset без LATERAL',
+                lambda: get_keyset_feed_page(author_ids, page_before, limit),
+            )
+            self.measure(
+                'стало, GET /api/recipes/feed/',
+                lambda: self.get('/api/recipes/feed/', **params),
+            )
+
+    def benchmark_search(self):
+        value = RECIPE_SEARCH_VALUE
+        self.stdout.write(f'  ?search={value}')
+        self.measure(
+            'было бы, icontains по названию и описанию',
+            self.get_page(
+                Recipe.objects.filter(
+                    Q(name__icontains=value) | Q(text__icontains=value),
+                ).order_by('-pub_date', 'id'),
+            ),
+        )
+        self.measure(
+            f'стало, фильтр search на {connection.vendor}',
+            self.get_page(self.filter_recipes(f'search={value}')),
+        )
+        self.measure(
+            'стало, GET /api/recipes/',
+            lambda: self.get(
+                '/api/recipes/', search=value, exact_count='true'),
+        )
+
+    def benchmark_recipe_ingredients(self):
+        # Ингредиенты одного из рецептов, чтобы выборка была не пустой
+        ingredient_ids = list(RecipeIngredient.objects.filter(
+            recipe_id=self.recipe_ids[0],
+        ).values_list('ingredient_id', flat=True)[:3])
+        ids = ','.join(map(str, ingredient_ids))
+        # Как было бы через ORM: JOIN RecipeIngredient на каждый ингредиент
+        joined = Recipe.objects.all()
+        for ingredient_id in ingredient_ids:
+            joined = joined.filter(
+                recipeingredient__ingredient_id=ingredient_id)
+        self.stdout.write(f'  ?ingredients={ids}')
+        self.measure(
+            'было бы, JOIN на каждый ингредиент', self.get_page(joined))
+        self.measure(
+            'стало, сгруппированный подзапрос',
+            self.get_page(self.filter_recipes(f'ingredients={ids}')),
+        )
+        self.measure(
+            'стало, GET /api/recipes/',
+            lambda: self.get(
+                '/api/recipes/', ingredients=ids, exact_count='true'),
+        )
+        self.stdout.write(f'  ?ingredients={ids}&ingredients_match=2')
+        self.measure(
+            'стало, хотя бы 2 из 3 с ранжированием',
+            self.get_page(self.filter_recipes(
+                f'ingredients={ids}&ingredients_match=2')),
+        )
+        self.stdout.write(f'  ?exclude_ingredients={ids}')
+        self.measure(
+            'стало, исключение ингредиентов',
+            self.get_page(self.filter_recipes(f'exclude_ingredients={ids}')),
+        )
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from api.bulk import export_recipes
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Выгружает все рецепты в формате JSON lines для import_recipes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path',
+            nargs='?',
+            default='-',
+            help='Файл для выгрузки, по умолчанию stdout',
+        )
+
+    def handle(self, *args, **options):
+        if options['path'] == '-':
+            for line in export_recipes(Recipe.objects.all()):
+                self.stdout.write(line, ending='')
+            return
+        with open(options['path'], 'w', encoding='utf-8') as output:
+            output.writelines(export_recipes(Recipe.objects.all()))
+        self.stdout.write(self.style.SUCCESS(
+            f'Рецепты выгружены в {options["path"]}'))
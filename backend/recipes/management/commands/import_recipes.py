@@ -0,0 +1,55 @@
+import json
+import sys
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from api.bulk import RecipeImporter
+from foodgram_backend import constants
+
+
+class Command(BaseCommand):
+    help = (
+        'Импортирует рецепты из файла JSON lines (формат export_recipes). '
+        'Ошибки строк выводятся в stderr.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл JSON lines, - для stdin')
+        parser.add_argument(
+            '--author',
+            help='Username автора для строк без поля author',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=constants.RECIPE_IMPORT_BATCH_SIZE,
+        )
+
+    def handle(self, *args, **options):
+        author = None
+        if options['author']:
+            try:
+                author = get_user_model().objects.get(
+                    username=options['author'])
+            except get_user_model().DoesNotExist:
+                raise CommandError(
+                    f'Пользователь {options["author"]} не найден')
+        importer = RecipeImporter(
+            author=author,
+            use_row_author=True,
+            batch_size=options['batch_size'],
+        )
+        # Строки читаются байтами: ошибка кодировки относится к строке,
+        # а не обрывает весь импорт
+        if options['path'] == '-':
+            report = importer.run(sys.stdin.buffer)
+        else:
+            with open(options['path'], 'rb') as lines:
+                report = importer.run(lines)
+        for error in report['errors']:
+            self.stderr.write(json.dumps(error, ensure_ascii=False))
+        self.stdout.write(self.style.SUCCESS(
+            f'Импортировано рецептов: {report["created"]}, '
+            f'строк с ошибками: {len(report["errors"])}'
+        ))
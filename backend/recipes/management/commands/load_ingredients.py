@@ -0,0 +1,114 @@
+import csv
+import json
+from collections import Counter
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from api.catalogue import bump_catalogue_version
+from foodgram_backend import constants
+from recipes.models import Ingredient
+
+
+def read_csv(path):
+    with open(path, encoding='utf-8', newline='') as csv_file:
+        for row in csv.reader(csv_file):
+            if row:
+                yield row[0].strip(), row[1].strip()
+
+
+def read_json(path):
+    with open(path, encoding='utf-8') as json_file:
+        for ingredient in json.load(json_file):
+            yield (
+                ingredient['name'].strip(),
+                ingredient['measurement_unit'].strip(),
+            )
+
+
+READERS = {
+    'csv': read_csv,
+    'json': read_json,
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Загружает справочник ингредиентов из CSV или JSON: новые '
+        'добавляются, у существующих обновляется единица измерения. '
+        'Повторный запуск ничего не меняет.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path',
+            nargs='?',
+            default=constants.INGREDIENTS_DATA_PATH,
+            help='Файл data/ingredients.csv или data/ingredients.json',
+        )
+        parser.add_argument(
+            '--format',
+            choices=READERS,
+            help='Формат файла, по умолчанию - по расширению',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=constants.INGREDIENT_LOAD_BATCH_SIZE,
+        )
+
+    def upsert(self, batch):
+        # Повтор названия внутри пакета: побеждает последняя строка
+        units = dict(batch)
+        existing = Ingredient.objects.filter(
+            name__in=units,
+        ).only('pk', 'name', 'measurement_unit')
+        changed = []
+        for ingredient in existing:
+            unit = units.pop(ingredient.name)
+            if ingredient.measurement_unit != unit:
+                ingredient.measurement_unit = unit
+                changed.append(ingredient)
+        Ingredient.objects.bulk_create(
+            [
+                Ingredient(name=name, measurement_unit=unit)
+                for name, unit in units.items()
+            ],
+            ignore_conflicts=True,
+        )
+        Ingredient.objects.bulk_update(changed, ['measurement_unit'])
+        return len(changed)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        data_format = options['format'] or path.rsplit('.', 1)[-1].lower()
+        if data_format not in READERS:
+            raise CommandError(f'Неизвестный формат файла: {path}')
+        rows = READERS[data_format](path)
+        measures = Counter()
+        updated = 0
+        try:
+            with transaction.atomic():
+                # ignore_conflicts не сообщает, какие строки пропущены,
+                # добавленные считаются по числу строк до и после загрузки
+                count_before = Ingredient.objects.count()
+                while True:
+                    batch = list(islice(rows, options['batch_size']))
+                    if not batch:
+                        break
+                    measures.update(unit for _, unit in batch)
+                    updated += self.upsert(batch)
+                created = Ingredient.objects.count() - count_before
+        except (OSError, KeyError, IndexError, ValueError) as error:
+            raise CommandError(f'Не удалось прочитать {path}: {error!r}')
+        # bulk_create и bulk_update не шлют сигналов, кэш справочника
+        # сбрасываем сами и только если он изменился
+        if created or updated:
+            bump_catalogue_version(Ingredient)
+        for unit, count in measures.most_common():
+            self.stdout.write(f'{unit}: {count}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Строк: {sum(measures.values())}, добавлено: {created}, '
+            f'обновлено: {updated}'
+        ))
@@ -0,0 +1,30 @@
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.management.base import BaseCommand
+
+from api.images import process_recipe_image
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = (
+        'Готовит WebP-копии изображений рецептов, у которых их еще нет: '
+        'после loaddata, import_recipes или сбоя фоновой обработки.'
+    )
+
+    def handle(self, *args, **options):
+        processed = failed = 0
+        recipes = Recipe.objects.exclude(image='').only(
+            'pk', 'image', 'image_variants').order_by('pk')
+        for recipe in recipes.iterator():
+            if recipe.get_image_variant_widths():
+                continue
+            try:
+                process_recipe_image(recipe.pk, recipe.image.name)
+            except (OSError, SuspiciousFileOperation, ValueError) as error:
+                failed += 1
+                self.stderr.write(f'{recipe.image.name}: {error}')
+                continue
+            processed += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано изображений: {processed}, с ошибками: {failed}'
+        ))
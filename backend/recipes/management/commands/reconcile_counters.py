@@ -0,0 +1,21 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from recipes.counters import reconcile_counters
+from recipes.models import Cart, Favorite, Recipe
+from users.models import Follow
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитывает счетчики избранного, корзин, рецептов '
+        'и подписчиков по исходным таблицам.'
+    )
+
+    def handle(self, *args, **options):
+        recipes, users = reconcile_counters(
+            Recipe, get_user_model(), Favorite, Cart, Follow)
+        self.stdout.write(self.style.SUCCESS(
+            f'Счетчики пересчитаны: рецептов - {recipes}, '
+            f'пользователей - {users}'
+        ))
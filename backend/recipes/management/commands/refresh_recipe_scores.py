@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from recipes.models import RecipeScore
+
+
+class Command(BaseCommand):
+    help = (
+        'Добавляет в трендовые рейтинги рецептов новые добавления '
+        'в избранное и корзины. Запускается по расписанию.'
+    )
+
+    def handle(self, *args, **options):
+        processed = RecipeScore.refresh()
+        self.stdout.write(self.style.SUCCESS(
+            f'Рейтинги обновлены: новых добавлений - {processed}'
+        ))
@@ -0,0 +1,24 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    # Составные индексы для поиска рецептов по тегу и по корзине.
+    # Favorite(user, recipe) уже покрыт уникальным ограничением
+    # unique_key_user_recipe
+
+    dependencies = [
+        ('recipes', '0005_catalogueversion'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            'CREATE INDEX recipes_recipe_tags_tag_recipe_idx '
+            'ON recipes_recipe_tags (tag_id, recipe_id)',
+            'DROP INDEX recipes_recipe_tags_tag_recipe_idx',
+        ),
+        migrations.RunSQL(
+            'CREATE INDEX recipes_cart_recipes_recipe_cart_idx '
+            'ON recipes_cart_recipes (recipe_id, cart_id)',
+            'DROP INDEX recipes_cart_recipes_recipe_cart_idx',
+        ),
+    ]
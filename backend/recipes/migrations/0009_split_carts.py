@@ -0,0 +1,50 @@
+from django.db import migrations
+
+
+def split_carts(apps, schema_editor):
+    # Каждая пара (пользователь, рецепт) становится отдельной строкой Cart,
+    # повторы и пустые корзины удаляются
+    Cart = apps.get_model('recipes', 'Cart')
+    CartRecipes = Cart.recipes.through
+    seen = set()
+    assigned_cart_ids = set()
+    new_carts = []
+    for cart_id, owner_id, recipe_id in CartRecipes.objects.values_list(
+        'cart_id', 'cart__owner_id', 'recipe_id',
+    ).order_by('cart_id', 'recipe_id'):
+        if (owner_id, recipe_id) in seen:
+            continue
+        seen.add((owner_id, recipe_id))
+        if cart_id in assigned_cart_ids:
+            new_carts.append(Cart(owner_id=owner_id, recipe_id=recipe_id))
+            continue
+        assigned_cart_ids.add(cart_id)
+        Cart.objects.filter(pk=cart_id).update(recipe_id=recipe_id)
+    Cart.objects.filter(recipe__isnull=True).delete()
+    Cart.objects.bulk_create(new_carts, batch_size=1000)
+
+
+def join_carts(apps, schema_editor):
+    Cart = apps.get_model('recipes', 'Cart')
+    Cart.recipes.through.objects.bulk_create(
+        [
+            Cart.recipes.through(cart_id=cart_id, recipe_id=recipe_id)
+            for cart_id, recipe_id in Cart.objects.values_list(
+                'pk', 'recipe_id')
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+    # Перенос данных идет отдельной миграцией: в одной транзакции
+    # с ним ALTER TABLE на PostgreSQL упал бы из-за отложенных
+    # триггеров внешних ключей
+
+    dependencies = [
+        ('recipes', '0008_cart_recipe'),
+    ]
+
+    operations = [
+        migrations.RunPython(split_carts, join_carts),
+    ]
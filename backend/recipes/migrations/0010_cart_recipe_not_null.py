@@ -0,0 +1,32 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0009_split_carts'),
+    ]
+
+    operations = [
+        # Индекс из 0006 удаляется явно, чтобы при откате он создавался
+        # заново вместе с промежуточной таблицей
+        migrations.RunSQL(
+            'DROP INDEX recipes_cart_recipes_recipe_cart_idx',
+            'CREATE INDEX recipes_cart_recipes_recipe_cart_idx '
+            'ON recipes_cart_recipes (recipe_id, cart_id)',
+        ),
+        migrations.RemoveField(
+            model_name='cart',
+            name='recipes',
+        ),
+        migrations.AlterField(
+            model_name='cart',
+            name='recipe',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='carts', to='recipes.recipe', verbose_name='Рецепт'),
+        ),
+        migrations.AddConstraint(
+            model_name='cart',
+            constraint=models.UniqueConstraint(fields=('owner', 'recipe'), name='unique_key_owner_recipe'),
+        ),
+    ]
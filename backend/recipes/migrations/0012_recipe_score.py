@@ -0,0 +1,56 @@
+import datetime
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0011_recipe_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='created',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now, verbose_name='Дата добавления'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='favorite',
+            name='created',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now, verbose_name='Дата добавления'),
+            preserve_default=False,
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-favorites_count', 'id'], name='recipe_favorites_count_idx'),
+        ),
+        migrations.CreateModel(
+            name='RecipeScore',
+            fields=[
+                ('recipe', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='score', serialize=False, to='recipes.recipe', verbose_name='Рецепт')),
+                ('trending_score', models.FloatField(db_index=True, default=0, verbose_name='Трендовый рейтинг')),
+            ],
+            options={
+                'verbose_name': 'Рейтинг рецепта',
+                'verbose_name_plural': 'Рейтинги рецептов',
+                'ordering': ('-trending_score',),
+            },
+        ),
+        migrations.CreateModel(
+            name='RecipeScoreState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('favorite_pk', models.BigIntegerField(default=0, verbose_name='Последнее учтенное избранное')),
+                ('cart_pk', models.BigIntegerField(default=0, verbose_name='Последняя учтенная корзина')),
+                ('epoch', models.DateTimeField(default=datetime.datetime(2024, 1, 1, 0, 0, tzinfo=datetime.timezone.utc), verbose_name='Эпоха весов')),
+            ],
+            options={
+                'verbose_name': 'Состояние трендовых рейтингов',
+                'verbose_name_plural': 'Состояние трендовых рейтингов',
+            },
+        ),
+    ]
@@ -1,7 +1,13 @@
+import os
+from collections import defaultdict
+
 from colorfield.fields import ColorField
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import MaxValueValidator, MinValueValidator
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Case, F, Sum, Value, When
+from django.utils import timezone
 
 from foodgram_backend import constants
 
@@ -54,15 +60,72 @@ class Recipe(models.Model):
         auto_now_add=True,
         verbose_name='Дата и время публикации рецепта',
     )
+    favorites_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Количество добавлений в избранное',
+    )
+    cart_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Количество добавлений в корзину',
+    )
+    # Имя изображения и ширины его WebP-копий, заполняется фоновой
+    # обработкой после сохранения рецепта
+    # Версия рецепта для ETag: меняется при сохранении, изменении
+    # ингредиентов, тегов и уменьшенных копий изображения
+    changed = models.DateTimeField(
+        auto_now=True,
+        verbose_name='Дата изменения',
+    )
+    image_variants = models.JSONField(
+        default=dict,
+        editable=False,
+        verbose_name='Уменьшенные копии изображения',
+    )
+    # Заполняется триггером PostgreSQL из названия и описания,
+    # GIN-индекс создается миграцией только на PostgreSQL
+    search_vector = SearchVectorField(
+        null=True,
+        editable=False,
+        verbose_name='Поисковый вектор',
+    )
 
     class Meta:
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
         ordering = ('pub_date', 'name',)
+        indexes = [
+            models.Index(
+                fields=['-favorites_count', 'id', ],
+                name='recipe_favorites_count_idx'
+            ),
+            # Лента рецептов автора в порядке Meta.ordering
+            models.Index(
+                fields=['author', 'pub_date', 'name', ],
+                name='recipe_author_pub_date_idx'
+            ),
+        ]
 
     def __str__(self):
         return self.name
 
+    @staticmethod
+    def get_image_variant_name(image_name, width):
+        directory, filename = os.path.split(image_name)
+        return os.path.join(
+            directory,
+            constants.RECIPE_IMAGE_VARIANTS_DIR,
+            f'{os.path.splitext(filename)[0]}_{width}.webp',
+        )
+
+    def get_image_variant_widths(self):
+        # Копии от прежнего изображения не подходят новому
+        if not self.image or (
+                self.image_variants.get('name') != self.image.name):
+            return []
+        return self.image_variants['widths']
+
 
 class Ingredient(models.Model):
 
@@ -125,6 +188,13 @@ class RecipeIngredient(models.Model):
                 name='unique_key_recipe_ingredient'
             ),
         ]
+        # Поиск рецептов по набору ингредиентов читает только индекс
+        indexes = [
+            models.Index(
+                fields=['ingredient', 'recipe', ],
+                name='recipe_ingredient_recipe_idx'
+            ),
+        ]
 
 
 class Tag(models.Model):
@@ -151,15 +221,62 @@ class Tag(models.Model):
         return self.name
 
 
+class CatalogueVersion(models.Model):
+    # Счетчик изменений справочников и списков рецептов и авторов, общий
+    # для всех воркеров. Версии отдельных рецептов и пользователей
+    # хранятся в их собственных строках
+    name = models.CharField(
+        max_length=constants.MAX_LENGTH_NAME,
+        unique=True,
+        verbose_name='Данные',
+    )
+    version = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Версия',
+    )
+
+    class Meta:
+        verbose_name = 'Версия данных'
+        verbose_name_plural = 'Версии данных'
+
+    def __str__(self):
+        return f'{self.name} - {self.version}'
+
+    @classmethod
+    def get_version(cls, name):
+        return cls.objects.filter(name=name).values_list(
+            'version', flat=True).first() or 0
+
+    @classmethod
+    def get_versions(cls, names):
+        versions = dict(
+            cls.objects.filter(name__in=names).values_list('name', 'version')
+        )
+        return [versions.get(name, 0) for name in names]
+
+    @classmethod
+    def bump(cls, *names):
+        for name in names:
+            if not cls.objects.filter(name=name).update(
+                    version=F('version') + 1):
+                cls.objects.get_or_create(
+                    name=name, defaults={'version': 1})
+
+
 class Cart(models.Model):
     owner = models.ForeignKey(
         to=User,
         on_delete=models.CASCADE,
         verbose_name='Заказчик',
     )
-    recipes = models.ManyToManyField(
+    recipe = models.ForeignKey(
         to=Recipe,
-        verbose_name='Рецепты'
+        on_delete=models.CASCADE,
+        verbose_name='Рецепт',
+    )
+    created = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Дата добавления',
     )
 
     class Meta:
@@ -167,6 +284,12 @@ class Cart(models.Model):
         verbose_name_plural = 'Корзины'
         ordering = ('pk',)
         default_related_name = 'carts'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['owner', 'recipe', ],
+                name='unique_key_owner_recipe'
+            ),
+        ]
 
     def __str__(self):
         return f'Корзина - {self.pk}'
@@ -183,6 +306,10 @@ class Favorite(models.Model):
         related_name='in_favorite',
         on_delete=models.CASCADE,
     )
+    created = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Дата добавления',
+    )
 
     class Meta:
         verbose_name = 'Подписки'
@@ -197,3 +324,260 @@ class Favorite(models.Model):
 
     def __str__(self):
         return f'Подписка - {self.pk}'
+
+
+class ShoppingListItem(models.Model):
+    # Материализованный список покупок: обновляется при изменении корзины,
+    # чтобы скачивание не пересчитывало сумму по всем рецептам корзины
+    owner = models.ForeignKey(
+        to=User,
+        on_delete=models.CASCADE,
+        verbose_name='Заказчик',
+    )
+    ingredient = models.ForeignKey(
+        to=Ingredient,
+        on_delete=models.CASCADE,
+        verbose_name='Ингредиент',
+    )
+    total_amount = models.IntegerField(
+        verbose_name='Общее количество',
+    )
+
+    class Meta:
+        verbose_name = 'Позиция списка покупок'
+        verbose_name_plural = 'Список покупок'
+        ordering = ('ingredient__name',)
+        default_related_name = 'shopping_list'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['owner', 'ingredient', ],
+                name='unique_key_owner_ingredient'
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.ingredient} - {self.total_amount}'
+
+    @staticmethod
+    def get_amounts(recipes):
+        return dict(
+            RecipeIngredient.objects.filter(
+                recipe__in=recipes,
+            ).values(
+                'ingredient_id',
+            ).annotate(
+                amount=Sum('amount'),
+            ).values_list('ingredient_id', 'amount')
+        )
+
+    @classmethod
+    def change_amounts(cls, owner_id, amounts, sign):
+        queryset = cls.objects.filter(
+            owner_id=owner_id, ingredient__in=amounts)
+        if amounts:
+            queryset.update(
+                total_amount=F('total_amount') + Case(
+                    *[
+                        When(ingredient_id=ingredient_id,
+                             then=Value(sign * amount))
+                        for ingredient_id, amount in amounts.items()
+                    ],
+                    default=Value(0),
+                ),
+            )
+        return queryset
+
+    @classmethod
+    @transaction.atomic
+    def add_recipes(cls, owner_id, recipes):
+        amounts = cls.get_amounts(recipes)
+        existing_ids = set(
+            cls.change_amounts(owner_id, amounts, 1).values_list(
+                'ingredient_id', flat=True)
+        )
+        cls.objects.bulk_create(
+            [
+                cls(
+                    owner_id=owner_id,
+                    ingredient_id=ingredient_id,
+                    total_amount=amount,
+                )
+                for ingredient_id, amount in amounts.items()
+                if ingredient_id not in existing_ids
+            ]
+        )
+
+    @classmethod
+    @transaction.atomic
+    def remove_recipes(cls, owner_id, recipes):
+        amounts = cls.get_amounts(recipes)
+        cls.change_amounts(owner_id, amounts, -1).filter(
+            total_amount__lte=0,
+        ).delete()
+
+    @classmethod
+    @transaction.atomic
+    def change_ingredient(cls, recipe_id, ingredient_id, amount):
+        """Меняет ингредиент рецепта в списках всех, у кого он в корзине."""
+        owner_ids = set(
+            Cart.objects.filter(
+                recipe_id=recipe_id,
+            ).values_list('owner_id', flat=True)
+        )
+        if not owner_ids or not amount:
+            return
+        queryset = cls.objects.filter(
+            owner_id__in=owner_ids, ingredient_id=ingredient_id)
+        queryset.update(total_amount=F('total_amount') + amount)
+        if amount < 0:
+            queryset.filter(total_amount__lte=0).delete()
+            return
+        existing_ids = set(queryset.values_list('owner_id', flat=True))
+        cls.objects.bulk_create(
+            [
+                cls(
+                    owner_id=owner_id,
+                    ingredient_id=ingredient_id,
+                    total_amount=amount,
+                )
+                for owner_id in owner_ids - existing_ids
+            ]
+        )
+
+    @classmethod
+    @transaction.atomic
+    def rebuild(cls, owners):
+        """Полный пересчет списков покупок указанных пользователей."""
+        cls.objects.filter(owner__in=owners).delete()
+        cls.objects.bulk_create(
+            [
+                cls(**item)
+                for item in RecipeIngredient.objects.filter(
+                    recipe__carts__owner__in=owners,
+                ).values(
+                    'ingredient_id',
+                    owner_id=F('recipe__carts__owner'),
+                ).annotate(
+                    total_amount=Sum('amount'),
+                ).order_by()
+            ]
+        )
+
+
+class RecipeScoreState(models.Model):
+    # Состояние пересчета трендовых рейтингов, одна строка: последние
+    # учтенные id избранного и корзин и эпоха, от которой считаются веса
+    favorite_pk = models.BigIntegerField(
+        default=0,
+        verbose_name='Последнее учтенное избранное',
+    )
+    cart_pk = models.BigIntegerField(
+        default=0,
+        verbose_name='Последняя учтенная корзина',
+    )
+    epoch = models.DateTimeField(
+        default=constants.TRENDING_EPOCH,
+        verbose_name='Эпоха весов',
+    )
+
+    class Meta:
+        verbose_name = 'Состояние трендовых рейтингов'
+        verbose_name_plural = 'Состояние трендовых рейтингов'
+
+    def __str__(self):
+        return f'{self.favorite_pk} - {self.cart_pk}'
+
+    @classmethod
+    def get_version(cls):
+        return list(
+            cls.objects.values_list('favorite_pk', 'cart_pk').first()
+            or (0, 0)
+        )
+
+
+class RecipeScore(models.Model):
+    # Трендовый рейтинг рецепта. Каждое добавление в избранное или корзину
+    # весит 2 ** ((t - epoch) / TRENDING_HALF_LIFE): порядок по такой сумме
+    # совпадает с порядком по затухающему во времени рейтингу, поэтому
+    # обновление только добавляет вклад новых строк. Чтобы веса не вышли
+    # за пределы float, эпоха периодически сдвигается вперед, а накопленные
+    # рейтинги делятся на тот же множитель
+    recipe = models.OneToOneField(
+        to=Recipe,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='score',
+        verbose_name='Рецепт',
+    )
+    trending_score = models.FloatField(
+        default=0,
+        db_index=True,
+        verbose_name='Трендовый рейтинг',
+    )
+
+    class Meta:
+        verbose_name = 'Рейтинг рецепта'
+        verbose_name_plural = 'Рейтинги рецептов'
+        ordering = ('-trending_score',)
+
+    def __str__(self):
+        return f'{self.recipe} - {self.trending_score}'
+
+    @staticmethod
+    def get_exponent(created, epoch):
+        # Время из будущего (расхождение часов) не раздувает вес
+        return min(
+            (created - epoch) / constants.TRENDING_HALF_LIFE,
+            constants.TRENDING_MAX_EXPONENT,
+        )
+
+    @classmethod
+    def get_weight(cls, created, weight, epoch):
+        return weight * 2 ** cls.get_exponent(created, epoch)
+
+    @classmethod
+    def rebase(cls, state, epoch):
+        """Переносит эпоху весов, сохраняя порядок рейтингов."""
+        # Отрицательная степень не переполняется, а уходит в ноль
+        factor = 2 ** -((epoch - state.epoch) / constants.TRENDING_HALF_LIFE)
+        cls.objects.update(trending_score=F('trending_score') * factor)
+        state.epoch = epoch
+
+    @classmethod
+    @transaction.atomic
+    def refresh(cls):
+        """Добавляет вклад новых строк Favorite и Cart в рейтинги."""
+        state, _ = RecipeScoreState.objects.select_for_update(
+        ).get_or_create(pk=1)
+        now = timezone.now()
+        if now - state.epoch > constants.TRENDING_REBASE_INTERVAL:
+            cls.rebase(state, now)
+        increments = defaultdict(float)
+        processed = 0
+        for model, watermark, weight in (
+            (Favorite, 'favorite_pk', constants.TRENDING_FAVORITE_WEIGHT),
+            (Cart, 'cart_pk', constants.TRENDING_CART_WEIGHT),
+        ):
+            rows = model.objects.filter(
+                pk__gt=getattr(state, watermark),
+            ).order_by('pk').values_list('pk', 'recipe_id', 'created')
+            for pk, recipe_id, created in rows.iterator():
+                increments[recipe_id] += cls.get_weight(
+                    created, weight, state.epoch)
+                setattr(state, watermark, pk)
+                processed += 1
+        state.save()
+        scores = cls.objects.in_bulk(list(increments))
+        for score in scores.values():
+            score.trending_score += increments[score.pk]
+        cls.objects.bulk_update(
+            scores.values(), ['trending_score'], batch_size=1000)
+        cls.objects.bulk_create(
+            [
+                cls(recipe_id=recipe_id, trending_score=increment)
+                for recipe_id, increment in increments.items()
+                if recipe_id not in scores
+            ],
+            batch_size=1000,
+        )
+        return processed
@@ -0,0 +1,88 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from recipes.counters import change_counter
+from recipes.models import (Cart, Favorite, Recipe, RecipeIngredient,
+                            ShoppingListItem)
+
+User = get_user_model()
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_delete, sender=Favorite)
+def update_favorites_count(sender, instance, created=False, **kwargs):
+    if kwargs['signal'] is post_save and not created:
+        return
+    change_counter(
+        Recipe.objects.filter(pk=instance.recipe_id),
+        'favorites_count',
+        1 if created else -1,
+    )
+
+
+@receiver(post_save, sender=Cart)
+@receiver(post_delete, sender=Cart)
+def update_cart_count(sender, instance, created=False, **kwargs):
+    if kwargs['signal'] is post_save and not created:
+        return
+    change_counter(
+        Recipe.objects.filter(pk=instance.recipe_id),
+        'cart_count',
+        1 if created else -1,
+    )
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def update_recipes_count(sender, instance, created=False, **kwargs):
+    if kwargs['signal'] is post_save and not created:
+        return
+    change_counter(
+        User.objects.filter(pk=instance.author_id),
+        'recipes_count',
+        1 if created else -1,
+    )
+
+
+@receiver(pre_save, sender=Cart)
+@receiver(pre_save, sender=RecipeIngredient)
+def remember_previous_row(sender, instance, **kwargs):
+    # Строку могут изменить в админке: старое значение нужно, чтобы
+    # вычесть его из списка покупок
+    instance._previous_row = None
+    if not instance._state.adding:
+        instance._previous_row = sender.objects.filter(
+            pk=instance.pk).first()
+
+
+@receiver(post_save, sender=Cart)
+def add_cart_to_shopping_list(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_previous_row', None)
+    if previous is not None:
+        ShoppingListItem.remove_recipes(
+            previous.owner_id, [previous.recipe_id])
+    ShoppingListItem.add_recipes(instance.owner_id, [instance.recipe_id])
+
+
+@receiver(post_delete, sender=Cart)
+def remove_cart_from_shopping_list(sender, instance, **kwargs):
+    # При каскадном удалении рецепта ингредиенты могут быть удалены раньше
+    # корзины, тогда их вклад уже вычтен обработчиком RecipeIngredient
+    ShoppingListItem.remove_recipes(instance.owner_id, [instance.recipe_id])
+
+
+@receiver(post_save, sender=RecipeIngredient)
+def add_ingredient_to_shopping_lists(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_previous_row', None)
+    if previous is not None:
+        ShoppingListItem.change_ingredient(
+            previous.recipe_id, previous.ingredient_id, -previous.amount)
+    ShoppingListItem.change_ingredient(
+        instance.recipe_id, instance.ingredient_id, instance.amount)
+
+
+@receiver(post_delete, sender=RecipeIngredient)
+def remove_ingredient_from_shopping_lists(sender, instance, **kwargs):
+    ShoppingListItem.change_ingredient(
+        instance.recipe_id, instance.ingredient_id, -instance.amount)
@@ -11,7 +11,7 @@ User = get_user_model()
 
 @admin.register(User)
 class UserModelAdmin(UserAdmin):
-    list_display = ('pk', 'username',)
+    list_display = ('pk', 'username', 'recipes_count', 'followers_count',)
     list_filter = ('username', 'email', 'first_name',)
     search_fields = ('username', 'email', 'first_name',)
 
@@ -1,6 +1,7 @@
 from django.contrib.auth.models import AbstractUser
 from django.contrib.auth.validators import UnicodeUsernameValidator
 from django.db import models
+from django.utils import timezone
 
 from foodgram_backend import constants
 
@@ -30,6 +31,22 @@ class User(AbstractUser):
         blank=False,
         verbose_name='Фамилия',
     )
+    recipes_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Количество рецептов',
+    )
+    followers_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Количество подписчиков',
+    )
+    # Версия флагов пользователя в ответах API для ETag
+    relations_changed = models.DateTimeField(
+        default=timezone.now,
+        editable=False,
+        verbose_name='Дата изменения избранного, корзины и подписок',
+    )
 
     class Meta:
         ordering = (